@@ -4,6 +4,16 @@ import hashlib
 from datetime import datetime
 import random
 import secrets
+import threading
+import time
+import queue
+import functools
+import csv
+import statistics
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
 
 # ==========================================
 # 1. PAGE CONFIG & CSS STYLING (HIERARCHY UI)
@@ -249,16 +259,163 @@ if "show_create_t" not in st.session_state:
 
 # ------------------ DB helpers ------------------ #
 
+DB_POOL_SIZE = 8
+DB_POOL_TIMEOUT = 10.0  # giây chờ tối đa khi pool đã hết kết nối rảnh
+
+class ConnectionPool:
+    """
+    Pool kết nối SQLite dùng chung cho cả process (mọi session Streamlit):
+    - Mỗi kết nối chỉ chạy PRAGMA cấu hình 1 lần khi được tạo.
+    - Mượn / trả kết nối qua `with pool.connection() as conn:` (hoặc acquire/release).
+    - Ghi lại số lần mượn, số lần phải chờ và thời gian chờ để theo dõi tranh chấp.
+    """
+
+    def __init__(self, db_path, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.timeout)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.max_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                # Pool đã đầy -> chờ kết nối được trả lại
+                start = time.perf_counter()
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("Hết kết nối CSDL trong pool (chờ quá lâu).")
+                finally:
+                    waited = time.perf_counter() - start
+                    with self._lock:
+                        self._waits += 1
+                        self._wait_total += waited
+                        self._wait_max = max(self._wait_max, waited)
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+        return conn
+
+    def release(self, conn):
+        # Giao dịch dở dang (quên commit) bị huỷ, giống hành vi conn.close() cũ
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            self._in_use -= 1
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self._created,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": self._created - self._in_use,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_total_ms": round(self._wait_total * 1000, 2),
+                "wait_max_ms": round(self._wait_max * 1000, 2),
+            }
+
+class PooledConnection:
+    """
+    Kết nối mượn từ pool, dùng y như sqlite3.Connection.
+    close() trả kết nối về pool thay vì đóng thật (gọi nhiều lần vẫn an toàn).
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get("_conn")
+        if conn is None:
+            raise AttributeError(name)
+        return getattr(conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn)
+
+    def __del__(self):
+        # Lưới an toàn: kết nối bị bỏ quên (vd. st.stop() giữa chừng) vẫn quay về pool
+        if self.__dict__.get("_conn") is not None:
+            self.close()
+
+@st.cache_resource
+def get_pool(db_path=DB_PATH):
+    # cache_resource: 1 pool duy nhất cho cả process, không tạo lại mỗi lần rerun
+    return ConnectionPool(db_path)
+
 def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
+    pool = get_pool(DB_PATH)
+    return PooledConnection(pool, pool.acquire())
 
-def init_db():
+@contextmanager
+def db_conn():
     conn = get_conn()
-    cur = conn.cursor()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+# ------------------ Schema migrations ------------------ #
+# Mỗi bước migration có số phiên bản tăng dần; phiên bản hiện tại của DB được
+# lưu trong PRAGMA user_version. Chỉ các bước có số > user_version mới chạy.
+# Muốn đổi schema: THÊM bước mới vào cuối MIGRATIONS, không sửa bước cũ.
+# Mỗi bước tự chứa SQL của nó (đóng băng theo schema lúc viết), không gọi các hàm /
+# hằng SQL dùng lúc chạy (_rebuild_*, SQL_*, MANAGED_INDEXES) vì chúng còn thay đổi.
 
-    # Tables creation (kept same as logic)
+def _add_column_if_missing(cur, table, column, ddl):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in cur.fetchall()]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
+
+def _migration_base_tables(cur):
     cur.execute("""
         CREATE TABLE IF NOT EXISTS sessions (
             token TEXT PRIMARY KEY,
@@ -293,25 +450,6 @@ def init_db():
             is_active INTEGER NOT NULL DEFAULT 0
         )
     """)
-
-    # Bổ sung cột mới cho bảng tournaments nếu thiếu
-    cur.execute("PRAGMA table_info(tournaments)")
-    cols = [r[1] for r in cur.fetchall()]
-    if "competition_type" not in cols:
-        cur.execute("ALTER TABLE tournaments ADD COLUMN competition_type TEXT")
-    if "use_pools" not in cols:
-        cur.execute("ALTER TABLE tournaments ADD COLUMN use_pools INTEGER NOT NULL DEFAULT 1")
-    if "adv_per_pool" not in cols:
-        cur.execute("ALTER TABLE tournaments ADD COLUMN adv_per_pool INTEGER")
-
-    # BỔ SUNG CỘT gender, unit CHO BẢNG users NẾU DB CŨ CHƯA CÓ
-    cur.execute("PRAGMA table_info(users)")
-    ucols = [r[1] for r in cur.fetchall()]
-    if "gender" not in ucols:
-        cur.execute("ALTER TABLE users ADD COLUMN gender TEXT")
-    if "unit" not in ucols:
-        cur.execute("ALTER TABLE users ADD COLUMN unit TEXT")
-
     cur.execute("""
         CREATE TABLE IF NOT EXISTS tournament_players (
             tournament_id INTEGER NOT NULL,
@@ -365,30 +503,28 @@ def init_db():
         )
     """)
 
-    cur.execute("PRAGMA table_info(matches)")
-    mcols = [r[1] for r in cur.fetchall()]
-    if "team1_p1_id" not in mcols:
-        cur.execute("ALTER TABLE matches ADD COLUMN team1_p1_id INTEGER")
-    if "team1_p2_id" not in mcols:
-        cur.execute("ALTER TABLE matches ADD COLUMN team1_p2_id INTEGER")
-    if "team2_p1_id" not in mcols:
-        cur.execute("ALTER TABLE matches ADD COLUMN team2_p1_id INTEGER")
-    if "team2_p2_id" not in mcols:
-        cur.execute("ALTER TABLE matches ADD COLUMN team2_p2_id INTEGER")
-    # --- BỔ SUNG MỚI: Cột match_type ---
-    if "match_type" not in mcols:
-        # Giá trị mặc định là 'standard' (trận thường)
-        cur.execute("ALTER TABLE matches ADD COLUMN match_type TEXT DEFAULT 'standard'")
-
-    conn.commit()
-
-    # Kiểm tra xem user 'admin' đã tồn tại chưa
-    cur.execute("SELECT * FROM users WHERE username = 'admin'")
-    admin_user = cur.fetchone()
-
-    if admin_user is None:
-        # Chưa có admin -> tạo mới
-        password_hash = hash_password("admin")
+def _migration_tournament_format_columns(cur):
+    # DB cũ có thể đã có các cột này (do code thêm cột kiểu cũ) -> chỉ thêm nếu thiếu
+    _add_column_if_missing(cur, "tournaments", "competition_type", "competition_type TEXT")
+    _add_column_if_missing(cur, "tournaments", "use_pools", "use_pools INTEGER NOT NULL DEFAULT 1")
+    _add_column_if_missing(cur, "tournaments", "adv_per_pool", "adv_per_pool INTEGER")
+
+def _migration_user_profile_columns(cur):
+    _add_column_if_missing(cur, "users", "gender", "gender TEXT")
+    _add_column_if_missing(cur, "users", "unit", "unit TEXT")
+
+def _migration_team_match_columns(cur):
+    _add_column_if_missing(cur, "matches", "team1_p1_id", "team1_p1_id INTEGER")
+    _add_column_if_missing(cur, "matches", "team1_p2_id", "team1_p2_id INTEGER")
+    _add_column_if_missing(cur, "matches", "team2_p1_id", "team2_p1_id INTEGER")
+    _add_column_if_missing(cur, "matches", "team2_p2_id", "team2_p2_id INTEGER")
+    # Giá trị mặc định là 'standard' (trận thường)
+    _add_column_if_missing(cur, "matches", "match_type", "match_type TEXT DEFAULT 'standard'")
+
+def _migration_seed_admin(cur):
+    # Tạo tài khoản admin mặc định nếu chưa có
+    cur.execute("SELECT id FROM users WHERE username = 'admin'")
+    if cur.fetchone() is None:
         cur.execute("""
             INSERT INTO users (
                 username, password_hash, full_name, age,
@@ -398,7 +534,7 @@ def init_db():
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             "admin",
-            password_hash,
+            hash_password("admin"),
             "Administrator",
             0,
             "admin",
@@ -409,20 +545,276 @@ def init_db():
             "Ban tổ chức",  # unit mặc định
             datetime.utcnow().isoformat()
         ))
-        conn.commit()
-    else:
-        # ĐÃ tồn tại user admin -> cập nhật quyền lại cho chắc
-        cur.execute("""
-            UPDATE users
-            SET role = 'admin',
-                is_admin = 1,
-                is_btc = 1,
-                is_approved = 1
-            WHERE username = 'admin'
-        """)
-        conn.commit()
 
-    conn.close()
+# Bộ index được quản lý cho các truy vấn nóng (xem HOT_QUERIES / find_full_scans)
+MANAGED_INDEXES = {
+    "idx_matches_tournament": "matches (tournament_id)",
+    "idx_competitors_tournament_pool": "competitors (tournament_id, pool_name)",
+    "idx_tournament_players_status": "tournament_players (tournament_id, status)",
+    "idx_personal_ranking_ranked": "personal_ranking_items (ranked_user_id, position, owner_id)",
+    "idx_hnpr_scores_avg": "hnpr_scores (avg_pos, user_id)",
+    "idx_standings_tournament": "standings (tournament_id)",
+    "idx_bracket_nodes_match": "bracket_nodes (match_id)",
+    "idx_competitor_members_user": "competitor_members (user_id)",
+    "idx_personal_ranking_owner_key": "personal_ranking_items (owner_id, position)",
+    "idx_btc_ranking_key": "btc_ranking_items (position)",
+}
+
+def ensure_indexes(cur, names=None):
+    for name in (names or MANAGED_INDEXES):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {MANAGED_INDEXES[name]}")
+
+def _migration_hot_path_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_matches_tournament ON matches (tournament_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_competitors_tournament_pool ON competitors (tournament_id, pool_name)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tournament_players_status ON tournament_players (tournament_id, status)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_personal_ranking_ranked ON personal_ranking_items (ranked_user_id, position, owner_id)")
+
+def _migration_hnpr_scores(cur):
+    # BXH HNPR được lưu sẵn, cập nhật dần mỗi khi lưu / xoá phiếu cá nhân
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS hnpr_scores (
+            user_id INTEGER PRIMARY KEY,
+            sum_pos INTEGER NOT NULL,
+            vote_count INTEGER NOT NULL,
+            avg_pos REAL NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_hnpr_scores_avg ON hnpr_scores (avg_pos, user_id)")
+    # SQL đóng băng theo schema phiên bản 7: position là hạng 1..N của mỗi phiếu
+    cur.execute("DELETE FROM hnpr_scores")
+    cur.execute("""
+        INSERT INTO hnpr_scores (user_id, sum_pos, vote_count, avg_pos)
+        SELECT ranked_user_id, SUM(position), COUNT(*), AVG(position)
+        FROM personal_ranking_items
+        GROUP BY ranked_user_id
+    """)
+
+def _migration_standings(cur):
+    # SQL của bước này được "đóng băng" theo schema ở phiên bản 8 (chưa có matches.stage,
+    # swiss_byes...) - không gọi _rebuild_standings vì hàm đó còn thay đổi theo schema mới.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS standings (
+            competitor_id INTEGER PRIMARY KEY,
+            tournament_id INTEGER NOT NULL,
+            points INTEGER NOT NULL DEFAULT 0,
+            wins INTEGER NOT NULL DEFAULT 0,
+            pts_for INTEGER NOT NULL DEFAULT 0,
+            pts_against INTEGER NOT NULL DEFAULT 0,
+            pool_points INTEGER NOT NULL DEFAULT 0,
+            pool_wins INTEGER NOT NULL DEFAULT 0,
+            pool_pts_for INTEGER NOT NULL DEFAULT 0,
+            pool_pts_against INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_standings_tournament ON standings (tournament_id)")
+    cur.execute("DELETE FROM standings")
+    cur.execute("""
+        INSERT INTO standings (
+            competitor_id, tournament_id, points, wins, pts_for, pts_against,
+            pool_points, pool_wins, pool_pts_for, pool_pts_against
+        )
+        WITH sides AS (
+            SELECT
+                m.tournament_id,
+                m.competitor1_id AS competitor_id,
+                m.score1 AS own,
+                m.score2 AS opp,
+                m.winner_id = m.competitor1_id AS won,
+                CASE WHEN m.match_type = 'relay' THEN 4 ELSE 2 END AS win_pts,
+                c1.pool_name IS NOT NULL AND c1.pool_name = c2.pool_name AS same_pool
+            FROM matches m
+            JOIN competitors c1 ON c1.id = m.competitor1_id
+            JOIN competitors c2 ON c2.id = m.competitor2_id
+            WHERE m.confirmed_by IS NOT NULL
+            UNION ALL
+            SELECT
+                m.tournament_id,
+                m.competitor2_id,
+                m.score2,
+                m.score1,
+                m.winner_id = m.competitor2_id,
+                CASE WHEN m.match_type = 'relay' THEN 4 ELSE 2 END,
+                c1.pool_name IS NOT NULL AND c1.pool_name = c2.pool_name
+            FROM matches m
+            JOIN competitors c1 ON c1.id = m.competitor1_id
+            JOIN competitors c2 ON c2.id = m.competitor2_id
+            WHERE m.confirmed_by IS NOT NULL
+        )
+        SELECT
+            c.id,
+            c.tournament_id,
+            CAST(TOTAL(s.won * s.win_pts) AS INTEGER),
+            CAST(TOTAL(s.won) AS INTEGER),
+            CAST(TOTAL(s.own) AS INTEGER),
+            CAST(TOTAL(s.opp) AS INTEGER),
+            CAST(TOTAL(s.same_pool * s.won * s.win_pts) AS INTEGER),
+            CAST(TOTAL(s.same_pool * s.won) AS INTEGER),
+            CAST(TOTAL(s.same_pool * s.own) AS INTEGER),
+            CAST(TOTAL(s.same_pool * s.opp) AS INTEGER)
+        FROM competitors c
+        JOIN tournaments t ON t.id = c.tournament_id
+        LEFT JOIN sides s ON s.competitor_id = c.id AND s.tournament_id = c.tournament_id
+        GROUP BY c.id
+    """)
+
+def _migration_matches_fixtures(cur):
+    # Cho phép trận trong lịch chưa có tỉ số: SQLite không sửa được ràng buộc NOT NULL
+    # -> tạo lại bảng matches rồi chép dữ liệu sang.
+    cols = (
+        "id, tournament_id, competitor1_id, competitor2_id, score1, score2, winner_id, "
+        "reported_by, confirmed_by, team1_p1_id, team1_p2_id, team2_p1_id, team2_p2_id, match_type"
+    )
+    cur.execute("""
+        CREATE TABLE matches_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id INTEGER NOT NULL,
+            competitor1_id INTEGER NOT NULL,
+            competitor2_id INTEGER NOT NULL,
+            score1 INTEGER,
+            score2 INTEGER,
+            winner_id INTEGER,
+            reported_by INTEGER,
+            confirmed_by INTEGER,
+            team1_p1_id INTEGER,
+            team1_p2_id INTEGER,
+            team2_p1_id INTEGER,
+            team2_p2_id INTEGER,
+            match_type TEXT DEFAULT 'standard',
+            round_no INTEGER
+        )
+    """)
+    cur.execute(f"INSERT INTO matches_new ({cols}) SELECT {cols} FROM matches")
+    cur.execute("DROP TABLE matches")
+    cur.execute("ALTER TABLE matches_new RENAME TO matches")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_matches_tournament ON matches (tournament_id)")
+
+def _migration_match_courts(cur):
+    _add_column_if_missing(cur, "matches", "court_no", "court_no INTEGER")
+    _add_column_if_missing(cur, "matches", "slot_no", "slot_no INTEGER")
+
+def _migration_knockout(cur):
+    # Trận cũ đều là vòng bảng; trận loại trực tiếp không tính vào BXH
+    _add_column_if_missing(cur, "matches", "stage", "stage TEXT NOT NULL DEFAULT 'group'")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS bracket_nodes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tournament_id INTEGER NOT NULL,
+            round_no INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            competitor1_id INTEGER,
+            competitor2_id INTEGER,
+            seed1 INTEGER,
+            seed2 INTEGER,
+            winner_id INTEGER,
+            match_id INTEGER,
+            UNIQUE (tournament_id, round_no, slot)
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_bracket_nodes_match ON bracket_nodes (match_id)")
+
+def _migration_swiss(cur):
+    _add_column_if_missing(cur, "tournaments", "pairing_system", "pairing_system TEXT NOT NULL DEFAULT 'round_robin'")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS swiss_byes (
+            tournament_id INTEGER NOT NULL,
+            round_no INTEGER NOT NULL,
+            competitor_id INTEGER NOT NULL,
+            PRIMARY KEY (tournament_id, round_no)
+        )
+    """)
+
+def _migration_partner_history_index(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_competitor_members_user ON competitor_members (user_id)")
+
+def _migration_ranking_sort_keys(cur):
+    # position chuyển thành khoá sắp xếp thưa: nhân khoảng cách (1024) để có chỗ chèn giữa các VĐV;
+    # hạng giờ suy ra bằng ROW_NUMBER -> dựng lại hnpr_scores theo cách tính mới.
+    # Giá trị / SQL đóng băng theo phiên bản 14, không dùng RANKING_KEY_GAP / SQL_HNPR_FROM_BALLOTS.
+    cur.execute("UPDATE personal_ranking_items SET position = position * 1024.0")
+    cur.execute("UPDATE btc_ranking_items SET position = position * 1024.0")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_personal_ranking_owner_key ON personal_ranking_items (owner_id, position)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_btc_ranking_key ON btc_ranking_items (position)")
+    cur.execute("DELETE FROM hnpr_scores")
+    cur.execute("""
+        INSERT INTO hnpr_scores (user_id, sum_pos, vote_count, avg_pos)
+        SELECT ranked_user_id, SUM(rank), COUNT(*), AVG(rank)
+        FROM (
+            SELECT
+                ranked_user_id,
+                ROW_NUMBER() OVER (PARTITION BY owner_id ORDER BY position, ranked_user_id) AS rank
+            FROM personal_ranking_items
+        )
+        GROUP BY ranked_user_id
+    """)
+
+MIGRATIONS = [
+    (1, "Tạo các bảng cơ bản", _migration_base_tables),
+    (2, "Cột thể thức giải (competition_type, use_pools, adv_per_pool)", _migration_tournament_format_columns),
+    (3, "Cột giới tính / đơn vị của users", _migration_user_profile_columns),
+    (4, "Cột đội hình & loại trận của matches", _migration_team_match_columns),
+    (5, "Tài khoản admin mặc định", _migration_seed_admin),
+    (6, "Index cho các truy vấn nóng", _migration_hot_path_indexes),
+    (7, "Bảng HNPR lưu sẵn (hnpr_scores)", _migration_hnpr_scores),
+    (8, "Bảng BXH lưu sẵn (standings)", _migration_standings),
+    (9, "Lịch thi đấu: trận chưa có tỉ số + lượt đấu (round_no)", _migration_matches_fixtures),
+    (10, "Xếp sân / khung giờ cho trận (court_no, slot_no)", _migration_match_courts),
+    (11, "Vòng loại trực tiếp (matches.stage, bracket_nodes)", _migration_knockout),
+    (12, "Hệ Swiss (tournaments.pairing_system, swiss_byes)", _migration_swiss),
+    (13, "Index lịch sử đồng đội (competitor_members.user_id)", _migration_partner_history_index),
+    (14, "Khoá sắp xếp thưa cho BXH cá nhân / BTC (position)", _migration_ranking_sort_keys),
+]
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate_db(conn):
+    """
+    Chạy lần lượt các bước migration còn thiếu, mỗi bước 1 giao dịch riêng.
+    Trả về phiên bản schema sau khi chạy.
+    """
+    for version, _desc, step in MIGRATIONS:
+        if version <= get_schema_version(conn):
+            continue
+        # BEGIN IMMEDIATE giữ khoá ghi -> đọc lại user_version để tránh
+        # 2 process cùng chạy 1 bước
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            step(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return get_schema_version(conn)
+
+def ensure_admin_privileges(conn):
+    # User 'admin' luôn giữ đủ quyền (chỉ ghi khi thực sự bị thay đổi)
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE users
+        SET role = 'admin',
+            is_admin = 1,
+            is_btc = 1,
+            is_approved = 1
+        WHERE username = 'admin'
+          AND NOT (role = 'admin' AND is_admin = 1 AND is_btc = 1 AND is_approved = 1)
+    """)
+    conn.commit()
+
+@st.cache_resource
+def init_db(db_path=DB_PATH):
+    """
+    Đưa DB lên schema mới nhất. Nhờ cache_resource chỉ chạy 1 lần cho mỗi
+    file DB trong mỗi process, không chạy lại ở mỗi lần rerun.
+    """
+    with get_pool(db_path).connection() as conn:
+        version = migrate_db(conn)
+        ensure_admin_privileges(conn)
+    return version
 
 
 def hash_password(pw: str) -> str:
@@ -465,12 +857,14 @@ def create_session_token(user_id: int) -> str:
     conn.close()
     return token
 
+SQL_SESSION_USER = "SELECT u.* FROM sessions s JOIN users u ON u.id = s.user_id WHERE s.token = ?"
+
 def get_user_by_session_token(token: str):
     if not token: return None
     conn = get_conn()
     cur = conn.cursor()
     try:
-        cur.execute("SELECT u.* FROM sessions s JOIN users u ON u.id = s.user_id WHERE s.token = ?", (token,))
+        cur.execute(SQL_SESSION_USER, (token,))
         row = cur.fetchone()
     except sqlite3.OperationalError: row = None
     conn.close()
@@ -502,6 +896,104 @@ def require_role(roles):
         st.error("⛔ Bạn không có quyền truy cập.")
         st.stop()
 
+# ------------------ Derived-data cache ------------------ #
+# Cache dùng chung giữa mọi session cho dữ liệu dẫn xuất (HNPR, BXH giải, ...).
+# Khoá cache gồm version counter của các "phạm vi" dữ liệu mà kết quả phụ thuộc:
+#   "hnpr"              : phiếu xếp hạng cá nhân
+#   "btc"               : BXH do BTC thiết lập
+#   "users"             : thông tin hiển thị của thành viên (họ tên, ...)
+#   ("tournament", id)  : VĐV, cặp/đội, bảng, trận đấu của 1 giải
+# Mọi đường ghi phải gọi invalidate(...) SAU khi commit để tăng version tương ứng;
+# bản ghi cũ không bị xoá mà tự bị đẩy ra theo LRU.
+
+DERIVED_CACHE_SIZE = 512
+
+class DerivedCache:
+    def __init__(self, max_entries=DERIVED_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def bump(self, *scopes):
+        with self._lock:
+            for scope in scopes:
+                self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def get_or_compute(self, name, args, scopes, compute):
+        with self._lock:
+            key = (name, args, tuple(self._versions.get(sc, 0) for sc in scopes))
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+        # Tính ngoài lock để các session khác không phải chờ nhau
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+        return value
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 3) if total else None,
+                "evictions": self._evictions,
+            }
+
+@st.cache_resource
+def get_derived_cache():
+    return DerivedCache()
+
+def invalidate(*scopes):
+    get_derived_cache().bump(*scopes)
+    _RUN_MEMO.clear()
+
+def cached_derived(scopes):
+    """
+    Decorator cache kết quả theo version của các phạm vi dữ liệu.
+    `scopes` là list cố định hoặc hàm nhận cùng tham số với hàm được bọc.
+    Kết quả trả về dùng chung giữa các session -> chỉ được đọc, không sửa.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args):
+            sc = scopes(*args) if callable(scopes) else scopes
+            return get_derived_cache().get_or_compute(fn.__name__, args, sc, lambda: fn(*args))
+        wrapper.uncached = fn
+        return wrapper
+    return decorator
+
+# Memo theo từng lần chạy script: Streamlit chạy lại toàn bộ file trong một module
+# mới ở mỗi rerun, nên dict cấp module này chỉ sống trong 1 lần rerun của 1 session.
+# Nhờ đó các hàm gọi lặp lại trong cùng 1 lần vẽ trang (vd. nhiều tab / nhiều giải)
+# chỉ tính 1 lần mà không cần khoá hay version.
+_RUN_MEMO = {}
+
+def per_run(fn):
+    @functools.wraps(fn)
+    def wrapper(*args):
+        key = (fn.__name__, args)
+        if key not in _RUN_MEMO:
+            _RUN_MEMO[key] = fn(*args)
+        return _RUN_MEMO[key]
+    return wrapper
+
+def tournament_scope(t_id):
+    return ("tournament", int(t_id))
+
 # ------------------ Logic & Data Access ------------------ #
 
 def get_all_players(only_approved=True, include_admin=False):
@@ -545,42 +1037,268 @@ def get_all_players(only_approved=True, include_admin=False):
     conn.close()
     return rows
 
+# Cột position của personal_ranking_items / btc_ranking_items là KHOÁ SẮP XẾP (số thực, thưa),
+# không phải hạng: chuyển / chèn 1 VĐV chỉ cần ghi 1 dòng với khoá nằm giữa 2 hàng xóm.
+# Hạng (1..N) luôn suy ra bằng ROW_NUMBER() theo (position, ranked_user_id).
+RANKING_KEY_GAP = 1024.0
+
+SQL_PERSONAL_RANKING = """
+    SELECT
+        pri.ranked_user_id,
+        ROW_NUMBER() OVER (ORDER BY pri.position, pri.ranked_user_id) AS position,
+        u.full_name
+    FROM personal_ranking_items pri
+    JOIN users u ON u.id = pri.ranked_user_id
+    WHERE pri.owner_id = ?
+    ORDER BY pri.position, pri.ranked_user_id
+"""
+
 def get_personal_ranking(owner_id):
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT pri.ranked_user_id, pri.position, u.full_name FROM personal_ranking_items pri JOIN users u ON u.id = pri.ranked_user_id WHERE pri.owner_id = ? ORDER BY pri.position ASC", (owner_id,))
+    cur.execute(SQL_PERSONAL_RANKING, (owner_id,))
     rows = cur.fetchall()
     conn.close()
     return rows
 
+def _get_ballot_keys(cur, owner_id):
+    cur.execute(
+        "SELECT ranked_user_id, position FROM personal_ranking_items WHERE owner_id = ? ORDER BY position, ranked_user_id",
+        (owner_id,),
+    )
+    return [(r[0], r[1]) for r in cur.fetchall()]
+
+def _get_ballot_positions(cur, owner_id):
+    # {ranked_user_id: hạng} - hạng suy ra từ thứ tự khoá
+    return {uid: pos for pos, (uid, _key) in enumerate(_get_ballot_keys(cur, owner_id), start=1)}
+
+def _increasing_run(keys):
+    """
+    Chỉ số của 1 dãy con tăng dài nhất trong keys (bỏ qua None), O(n log n).
+    Các dòng này giữ nguyên khoá khi lưu; chỉ các dòng còn lại phải ghi.
+    """
+    tails, tail_keys, prev = [], [], [-1] * len(keys)
+    for i, k in enumerate(keys):
+        if k is None:
+            continue
+        p = bisect_left(tail_keys, k)
+        if p == len(tails):
+            tails.append(i)
+            tail_keys.append(k)
+        else:
+            tails[p] = i
+            tail_keys[p] = k
+        prev[i] = tails[p - 1] if p > 0 else -1
+    keep = set()
+    i = tails[-1] if tails else -1
+    while i != -1:
+        keep.add(i)
+        i = prev[i]
+    return keep
+
+def _plan_sort_keys(old_keys, ordered_ids):
+    """
+    Khoá sắp xếp mới cho thứ tự ordered_ids, ghi ít dòng nhất:
+    giữ khoá của dãy con tăng dài nhất, các đoạn còn lại chia đều vào khoảng giữa 2 khoá giữ lại.
+    Khi khoảng trống đã cạn (số thực không chia tiếp được) -> đánh lại khoá cách đều cho cả danh sách.
+    old_keys: {uid: khoá}. Trả về {uid: khoá mới} cho các dòng cần ghi.
+    """
+    n = len(ordered_ids)
+    keys = [old_keys.get(uid) for uid in ordered_ids]
+    keep = _increasing_run(keys)
+    new_keys = list(keys)
+    i = 0
+    while i < n:
+        if i in keep:
+            i += 1
+            continue
+        j = i
+        while j < n and j not in keep:
+            j += 1
+        lo = new_keys[i - 1] if i > 0 else None
+        hi = keys[j] if j < n else None
+        k = j - i
+        for t in range(k):
+            if lo is None and hi is None:
+                new_keys[i + t] = (t + 1) * RANKING_KEY_GAP
+            elif lo is None:
+                new_keys[i + t] = hi - (k - t) * RANKING_KEY_GAP
+            elif hi is None:
+                new_keys[i + t] = lo + (t + 1) * RANKING_KEY_GAP
+            else:
+                new_keys[i + t] = lo + (hi - lo) * (t + 1) / (k + 1)
+        i = j
+    if any(a >= b for a, b in zip(new_keys, new_keys[1:])):
+        new_keys = [(pos + 1) * RANKING_KEY_GAP for pos in range(n)]
+    return {uid: key for uid, key in zip(ordered_ids, new_keys) if old_keys.get(uid) != key}
+
+def _rankable_ids(cur):
+    # Những người được phép có mặt trong BXH: thành viên đã duyệt, trừ admin (như get_all_players)
+    cur.execute("SELECT id FROM users WHERE is_approved = 1 AND (is_admin IS NULL OR is_admin = 0)")
+    return {r[0] for r in cur.fetchall()}
+
+def _diff_ranking(old_order, ordered_ids):
+    """
+    So thứ tự mới với danh sách đang lưu (old_order: [(uid, khoá)] theo thứ tự khoá).
+    Trả về (old_positions, new_positions, writes [(khoá, uid)], removed [uid]);
+    *_positions là hạng suy ra {uid: hạng}, writes/removed chỉ gồm dòng thực sự phải ghi.
+    """
+    old_positions = {uid: pos for pos, (uid, _key) in enumerate(old_order, start=1)}
+    new_positions = {uid: pos for pos, uid in enumerate(ordered_ids, start=1)}
+    writes = [(key, uid) for uid, key in _plan_sort_keys(dict(old_order), ordered_ids).items()]
+    removed = [uid for uid in old_positions if uid not in new_positions]
+    return old_positions, new_positions, writes, removed
+
+def _apply_hnpr_delta(cur, old_positions, new_positions):
+    """
+    Cập nhật hnpr_scores theo chênh lệch giữa phiếu cũ và phiếu mới của 1 người
+    (old/new_positions: {ranked_user_id: position}).
+    Trả về danh sách user_id có điểm HNPR bị thay đổi.
+    """
+    deltas = []
+    for uid in set(old_positions) | set(new_positions):
+        old_pos = old_positions.get(uid)
+        new_pos = new_positions.get(uid)
+        if old_pos == new_pos:
+            continue
+        d_sum = (new_pos or 0) - (old_pos or 0)
+        d_count = (new_pos is not None) - (old_pos is not None)
+        deltas.append((uid, d_sum, d_count))
+    if not deltas:
+        return []
+    cur.executemany(
+        """
+        INSERT INTO hnpr_scores (user_id, sum_pos, vote_count, avg_pos)
+        VALUES (?1, ?2, ?3, CASE WHEN ?3 > 0 THEN 1.0 * ?2 / ?3 ELSE 0 END)
+        ON CONFLICT(user_id) DO UPDATE SET
+            sum_pos = sum_pos + excluded.sum_pos,
+            vote_count = vote_count + excluded.vote_count,
+            avg_pos = CASE
+                WHEN vote_count + excluded.vote_count > 0
+                THEN 1.0 * (sum_pos + excluded.sum_pos) / (vote_count + excluded.vote_count)
+                ELSE 0
+            END
+        """,
+        deltas,
+    )
+    cur.execute("DELETE FROM hnpr_scores WHERE vote_count <= 0")
+    return [d[0] for d in deltas]
+
 def save_personal_ranking(owner_id, ordered_ids):
+    """
+    Lưu phiếu cá nhân: chỉ ghi những dòng phải đổi khoá sắp xếp (1 transaction),
+    chuyển 1 VĐV = ghi 1 dòng.
+    Trả về danh sách user_id có hạng thay đổi (cũng là những người bị đổi điểm HNPR).
+    """
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("DELETE FROM personal_ranking_items WHERE owner_id = ?", (owner_id,))
-    for pos, uid in enumerate(ordered_ids, start=1):
-        cur.execute("INSERT INTO personal_ranking_items (owner_id, ranked_user_id, position) VALUES (?, ?, ?)", (owner_id, uid, pos))
+    cur.execute("BEGIN IMMEDIATE")
+    # Trang sửa giữ danh sách trong session_state -> bỏ người đã bị xoá / bỏ duyệt trong lúc sửa
+    allowed = _rankable_ids(cur) - {owner_id}
+    ordered_ids = [uid for uid in ordered_ids if uid in allowed]
+    old_positions, new_positions, writes, removed = _diff_ranking(_get_ballot_keys(cur, owner_id), ordered_ids)
+    cur.executemany(
+        """
+        INSERT INTO personal_ranking_items (owner_id, ranked_user_id, position) VALUES (?, ?, ?)
+        ON CONFLICT(owner_id, ranked_user_id) DO UPDATE SET position = excluded.position
+        """,
+        [(owner_id, uid, key) for key, uid in writes],
+    )
+    cur.executemany(
+        "DELETE FROM personal_ranking_items WHERE owner_id = ? AND ranked_user_id = ?",
+        [(owner_id, uid) for uid in removed],
+    )
+    changed = _apply_hnpr_delta(cur, old_positions, new_positions)
     conn.commit()
     conn.close()
+    if changed:
+        invalidate("hnpr")
+    return changed
 
 def delete_personal_ranking(owner_id):
     conn = get_conn()
     cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    old_positions = _get_ballot_positions(cur, owner_id)
     cur.execute("DELETE FROM personal_ranking_items WHERE owner_id = ?", (owner_id,))
+    changed = _apply_hnpr_delta(cur, old_positions, {})
     conn.commit()
     conn.close()
+    if changed:
+        invalidate("hnpr")
+
+# Tính HNPR từ đầu trên toàn bộ phiếu (dùng để dựng lại / đối chiếu hnpr_scores);
+# hạng trong mỗi phiếu suy ra từ khoá sắp xếp
+SQL_HNPR_FROM_BALLOTS = """
+    SELECT
+        ranked_user_id AS user_id,
+        SUM(rank) AS sum_pos,
+        COUNT(*) AS vote_count,
+        AVG(rank) AS avg_pos
+    FROM (
+        SELECT
+            ranked_user_id,
+            ROW_NUMBER() OVER (PARTITION BY owner_id ORDER BY position, ranked_user_id) AS rank
+        FROM personal_ranking_items
+    )
+    GROUP BY ranked_user_id
+"""
 
+def _rebuild_hnpr_scores(cur):
+    cur.execute("DELETE FROM hnpr_scores")
+    cur.execute(f"INSERT INTO hnpr_scores (user_id, sum_pos, vote_count, avg_pos) {SQL_HNPR_FROM_BALLOTS}")
+
+def rebuild_hnpr_scores():
+    """Dựng lại toàn bộ bảng hnpr_scores từ các phiếu cá nhân."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    _rebuild_hnpr_scores(cur)
+    conn.commit()
+    conn.close()
+    invalidate("hnpr")
+
+def check_hnpr_scores():
+    """
+    Đối chiếu hnpr_scores với kết quả tính lại từ đầu.
+    Trả về danh sách sai lệch [{user_id, expected, stored}]; rỗng = khớp.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(SQL_HNPR_FROM_BALLOTS)
+    expected = {r["user_id"]: (r["sum_pos"], r["vote_count"]) for r in cur.fetchall()}
+    cur.execute("SELECT user_id, sum_pos, vote_count FROM hnpr_scores")
+    stored = {r["user_id"]: (r["sum_pos"], r["vote_count"]) for r in cur.fetchall()}
+    conn.close()
+    return [
+        {"user_id": uid, "expected": expected.get(uid), "stored": stored.get(uid)}
+        for uid in sorted(set(expected) | set(stored))
+        if expected.get(uid) != stored.get(uid)
+    ]
+
+SQL_HNPR = """
+    SELECT
+        h.user_id,
+        u.full_name,
+        h.avg_pos,
+        h.vote_count,
+        ROW_NUMBER() OVER (ORDER BY h.avg_pos, h.user_id) AS rank
+    FROM hnpr_scores h
+    JOIN users u ON u.id = h.user_id
+    ORDER BY h.avg_pos, h.user_id
+"""
+
+@per_run
+@cached_derived(["hnpr", "users"])
 def compute_hnpr():
+    # Đọc từ bảng hnpr_scores đã lưu sẵn, hạng đánh trong SQL theo index (avg_pos, user_id)
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT ranked_user_id, AVG(position) AS avg_pos, COUNT(DISTINCT owner_id) AS vote_count FROM personal_ranking_items GROUP BY ranked_user_id HAVING vote_count > 0 ORDER BY avg_pos ASC")
-    rows = cur.fetchall()
-    result = []
-    rank = 1
-    for r in rows:
-        user = get_user_by_id(r["ranked_user_id"])
-        if not user: continue
-        result.append({"rank": rank, "user_id": r["ranked_user_id"], "full_name": user["full_name"], "avg_pos": r["avg_pos"], "vote_count": r["vote_count"]})
-        rank += 1
+    cur.execute(SQL_HNPR)
+    result = [
+        {"rank": r["rank"], "user_id": r["user_id"], "full_name": r["full_name"], "avg_pos": r["avg_pos"], "vote_count": r["vote_count"]}
+        for r in cur.fetchall()
+    ]
     conn.close()
     return result
 
@@ -589,19 +1307,24 @@ def get_hnpr_order_or_alpha():
     if ranking: return [r["user_id"] for r in ranking]
     else: return [p["id"] for p in get_all_players(only_approved=True)]
 
+SQL_BTC_RANKING = """
+    SELECT
+        b.ranked_user_id,
+        ROW_NUMBER() OVER (ORDER BY b.position, b.ranked_user_id) AS position,
+        u.full_name
+    FROM btc_ranking_items b
+    JOIN users u ON u.id = b.ranked_user_id
+    ORDER BY b.position, b.ranked_user_id
+"""
+
 def get_btc_ranking():
     """
     Lấy BXH do Ban tổ chức thiết lập:
-    trả về danh sách (ranked_user_id, position, full_name) sắp xếp theo position.
+    trả về danh sách (ranked_user_id, position, full_name) sắp xếp theo hạng (position = hạng 1..N).
     """
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("""
-        SELECT b.ranked_user_id, b.position, u.full_name
-        FROM btc_ranking_items b
-        JOIN users u ON u.id = b.ranked_user_id
-        ORDER BY b.position ASC
-    """)
+    cur.execute(SQL_BTC_RANKING)
     rows = cur.fetchall()
     conn.close()
     return rows
@@ -609,17 +1332,33 @@ def get_btc_ranking():
 def save_btc_ranking(ordered_ids):
     """
     Ghi lại BXH BTC theo thứ tự trong ordered_ids (1 là cao nhất).
+    Chỉ ghi những dòng phải đổi khoá sắp xếp (như phiếu cá nhân);
+    trả về danh sách user_id có hạng thay đổi hoặc bị bỏ khỏi BXH.
     """
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("DELETE FROM btc_ranking_items")
-    for pos, uid in enumerate(ordered_ids, start=1):
-        cur.execute("""
-            INSERT INTO btc_ranking_items (ranked_user_id, position)
-            VALUES (?, ?)
-        """, (uid, pos))
+    cur.execute("BEGIN IMMEDIATE")
+    # Trang sửa giữ danh sách trong session_state -> bỏ người đã bị xoá / bỏ duyệt trong lúc sửa
+    allowed = _rankable_ids(cur)
+    ordered_ids = [uid for uid in ordered_ids if uid in allowed]
+    cur.execute("SELECT ranked_user_id, position FROM btc_ranking_items ORDER BY position, ranked_user_id")
+    old_positions, new_positions, writes, removed = _diff_ranking(
+        [(r[0], r[1]) for r in cur.fetchall()], ordered_ids
+    )
+    cur.executemany("""
+        INSERT INTO btc_ranking_items (ranked_user_id, position)
+        VALUES (?, ?)
+        ON CONFLICT(ranked_user_id) DO UPDATE SET position = excluded.position
+    """, [(uid, key) for key, uid in writes])
+    cur.executemany(
+        "DELETE FROM btc_ranking_items WHERE ranked_user_id = ?",
+        [(uid,) for uid in removed],
+    )
     conn.commit()
     conn.close()
+    if writes or removed:
+        invalidate("btc")
+    return [uid for uid, pos in new_positions.items() if old_positions.get(uid) != pos] + removed
 
 def delete_btc_ranking():
     """
@@ -630,24 +1369,7 @@ def delete_btc_ranking():
     cur.execute("DELETE FROM btc_ranking_items")
     conn.commit()
     conn.close()
-
-def build_competitor_display_name(comp_id, members_map):
-    members = members_map.get(comp_id, [])
-    member_names = [m[1] for m in members]
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT name, kind FROM competitors WHERE id = ?", (comp_id,))
-    row = cur.fetchone()
-    conn.close()
-    if not row: return " + ".join(member_names) if member_names else str(comp_id)
-    base_name = row["name"]
-    kind = row["kind"]
-    if kind == "team":
-        if member_names: return f"{base_name} ({', '.join(member_names)})"
-        return base_name
-    else:
-        if member_names: return " + ".join(member_names)
-        return base_name
+    invalidate("btc")
 
 def get_tournaments():
     conn = get_conn()
@@ -673,20 +1395,14 @@ def get_tournament_by_id(t_id: int):
     conn.close()
     return row
 
-def upsert_tournament(t_id, name, start_date, end_date, location, num_courts, is_active, competition_type="pair", use_pools=True, adv_per_pool=None):
+def upsert_tournament(t_id, name, start_date, end_date, location, num_courts, is_active, competition_type="pair", use_pools=True, adv_per_pool=None, pairing_system="round_robin"):
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("PRAGMA table_info(tournaments)")
-    cols = [r[1] for r in cur.fetchall()]
-    if "competition_type" not in cols: cur.execute("ALTER TABLE tournaments ADD COLUMN competition_type TEXT")
-    if "use_pools" not in cols: cur.execute("ALTER TABLE tournaments ADD COLUMN use_pools INTEGER NOT NULL DEFAULT 1")
-    if "adv_per_pool" not in cols: cur.execute("ALTER TABLE tournaments ADD COLUMN adv_per_pool INTEGER")
-
     if t_id is None:
-        cur.execute("INSERT INTO tournaments (name, start_date, end_date, location, num_courts, is_active, competition_type, use_pools, adv_per_pool) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (name, start_date, end_date, location, num_courts, 1 if is_active else 0, competition_type, 1 if use_pools else 0, adv_per_pool))
+        cur.execute("INSERT INTO tournaments (name, start_date, end_date, location, num_courts, is_active, competition_type, use_pools, adv_per_pool, pairing_system) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", (name, start_date, end_date, location, num_courts, 1 if is_active else 0, competition_type, 1 if use_pools else 0, adv_per_pool, pairing_system))
         t_id = cur.lastrowid
     else:
-        cur.execute("UPDATE tournaments SET name = ?, start_date = ?, end_date = ?, location = ?, num_courts = ?, is_active = ?, competition_type = ?, use_pools = ?, adv_per_pool = ? WHERE id = ?", (name, start_date, end_date, location, num_courts, 1 if is_active else 0, competition_type, 1 if use_pools else 0, adv_per_pool, t_id))
+        cur.execute("UPDATE tournaments SET name = ?, start_date = ?, end_date = ?, location = ?, num_courts = ?, is_active = ?, competition_type = ?, use_pools = ?, adv_per_pool = ?, pairing_system = ? WHERE id = ?", (name, start_date, end_date, location, num_courts, 1 if is_active else 0, competition_type, 1 if use_pools else 0, adv_per_pool, pairing_system, t_id))
     conn.commit()
     conn.close()
     return t_id
@@ -698,9 +1414,27 @@ def delete_tournament(t_id):
     cur.execute("DELETE FROM competitor_members WHERE competitor_id IN (SELECT id FROM competitors WHERE tournament_id = ?)", (t_id,))
     cur.execute("DELETE FROM competitors WHERE tournament_id = ?", (t_id,))
     cur.execute("DELETE FROM matches WHERE tournament_id = ?", (t_id,))
+    cur.execute("DELETE FROM standings WHERE tournament_id = ?", (t_id,))
+    cur.execute("DELETE FROM bracket_nodes WHERE tournament_id = ?", (t_id,))
+    cur.execute("DELETE FROM swiss_byes WHERE tournament_id = ?", (t_id,))
     cur.execute("DELETE FROM tournaments WHERE id = ?", (t_id,))
     conn.commit()
     conn.close()
+    invalidate(tournament_scope(t_id))
+
+SQL_TOURNAMENT_PLAYERS_APPROVED = """
+    SELECT
+        tp.tournament_id,
+        tp.user_id,
+        tp.status,
+        tp.group_name,
+        u.full_name,
+        u.gender
+    FROM tournament_players tp
+    JOIN users u ON u.id = tp.user_id
+    WHERE tp.tournament_id = ? AND tp.status = 'approved'
+    ORDER BY u.full_name
+"""
 
 def get_tournament_players(tournament_id, approved_only: bool = True):
     """
@@ -710,22 +1444,7 @@ def get_tournament_players(tournament_id, approved_only: bool = True):
     conn = get_conn()
     cur = conn.cursor()
     if approved_only:
-        cur.execute(
-            """
-            SELECT
-                tp.tournament_id,
-                tp.user_id,
-                tp.status,
-                tp.group_name,
-                u.full_name,
-                u.gender
-            FROM tournament_players tp
-            JOIN users u ON u.id = tp.user_id
-            WHERE tp.tournament_id = ? AND tp.status = 'approved'
-            ORDER BY u.full_name
-            """,
-            (tournament_id,),
-        )
+        cur.execute(SQL_TOURNAMENT_PLAYERS_APPROVED, (tournament_id,))
     else:
         cur.execute(
             """
@@ -804,11 +1523,14 @@ def set_tournament_players(tournament_id, user_ids):
 
     conn.commit()
     conn.close()
+    invalidate(tournament_scope(tournament_id))
+
+SQL_COMPETITORS_BY_TOURNAMENT = "SELECT * FROM competitors WHERE tournament_id = ? ORDER BY id"
 
 def get_competitors(tournament_id):
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM competitors WHERE tournament_id = ? ORDER BY id", (tournament_id,))
+    cur.execute(SQL_COMPETITORS_BY_TOURNAMENT, (tournament_id,))
     rows = cur.fetchall()
     conn.close()
     return rows
@@ -820,11 +1542,16 @@ def clear_competitors_and_matches(tournament_id):
     comp_ids = [r["id"] for r in cur.fetchall()]
     if comp_ids: cur.executemany("DELETE FROM competitor_members WHERE competitor_id = ?", [(cid,) for cid in comp_ids])
     cur.execute("DELETE FROM matches WHERE tournament_id = ?", (tournament_id,))
+    cur.execute("DELETE FROM standings WHERE tournament_id = ?", (tournament_id,))
+    cur.execute("DELETE FROM bracket_nodes WHERE tournament_id = ?", (tournament_id,))
+    cur.execute("DELETE FROM swiss_byes WHERE tournament_id = ?", (tournament_id,))
     cur.execute("DELETE FROM competitors WHERE tournament_id = ?", (tournament_id,))
     conn.commit()
     conn.close()
+    invalidate(tournament_scope(tournament_id))
 
 def create_competitor(conn, tournament_id, member_ids):
+    # Chạy trong giao dịch của caller -> caller gọi invalidate(tournament_scope(...)) sau khi commit
     cur = conn.cursor()
     placeholders = ",".join("?" * len(member_ids))
     cur.execute(f"SELECT full_name FROM users WHERE id IN ({placeholders}) ORDER BY full_name", member_ids)
@@ -837,38 +1564,47 @@ def create_competitor(conn, tournament_id, member_ids):
         cur.execute("INSERT INTO competitor_members (competitor_id, user_id) VALUES (?, ?)", (comp_id, uid))
     return comp_id
 
+# Lấy thành viên của mọi cặp/đội trong giải kèm điểm HNPR của chính họ
+# (LEFT JOIN hnpr_scores) -> không cần tính cả BXH HNPR chỉ để sắp xếp.
+SQL_COMPETITOR_MEMBERS = """
+    SELECT
+        cm.competitor_id,
+        u.id AS user_id,
+        u.full_name,
+        tp.group_name,
+        h.avg_pos AS hnpr_avg_pos
+    FROM competitors c
+    JOIN competitor_members cm ON cm.competitor_id = c.id
+    JOIN users u ON u.id = cm.user_id
+    LEFT JOIN tournament_players tp
+        ON tp.tournament_id = c.tournament_id
+       AND tp.user_id = u.id
+    LEFT JOIN hnpr_scores h ON h.user_id = u.id
+    WHERE c.tournament_id = ?
+"""
+
+@per_run
+@cached_derived(lambda t_id: [tournament_scope(t_id), "hnpr", "users"])
 def get_competitor_members_map(t_id):
     conn = get_conn()
     cur = conn.cursor()
 
-    cur.execute(
-        """
-        SELECT
-            cm.competitor_id,
-            u.id AS user_id,
-            u.full_name,
-            tp.group_name
-        FROM competitor_members cm
-        JOIN users u ON u.id = cm.user_id
-        LEFT JOIN tournament_players tp
-            ON tp.tournament_id = ?
-           AND tp.user_id = u.id
-        """,
-        (t_id,),
-    )
+    cur.execute(SQL_COMPETITOR_MEMBERS, (t_id,))
 
     rows = cur.fetchall()
     conn.close()
 
-    # ===== HNPR MAP =====
-    hnpr = compute_hnpr()
-    rank_map = {r["user_id"]: idx for idx, r in enumerate(hnpr)}
-
     def group_rank(g):
         if not g:
             return 999  # chưa phân nhóm trình → xuống cuối
         return ord(g.upper()) - ord("A")
 
+    def hnpr_key(r):
+        # Cùng thứ tự với compute_hnpr (avg_pos, user_id); chưa có HNPR → xuống cuối
+        if r["hnpr_avg_pos"] is None:
+            return (1, 0, 0)
+        return (0, r["hnpr_avg_pos"], r["user_id"])
+
     m_map = {}
 
     for r in rows:
@@ -877,7 +1613,7 @@ def get_competitor_members_map(t_id):
                 "user_id": r["user_id"],
                 "full_name": r["full_name"],
                 "group_rank": group_rank(r["group_name"]),
-                "hnpr_rank": rank_map.get(r["user_id"], 9999),
+                "hnpr_key": hnpr_key(r),
             }
         )
 
@@ -886,7 +1622,7 @@ def get_competitor_members_map(t_id):
         members.sort(
             key=lambda x: (
                 x["group_rank"],
-                x["hnpr_rank"],
+                x["hnpr_key"],
                 x["full_name"].lower(),
             )
         )
@@ -894,117 +1630,1230 @@ def get_competitor_members_map(t_id):
 
     return m_map
 
+def format_competitor_name(name, kind, member_names):
+    if kind == "team":
+        if member_names: return f"{name} ({', '.join(member_names)})"
+        return name
+    else:
+        if member_names: return " + ".join(member_names)
+        return name
+
+def get_competitor_display_names(t_id, comps=None, members_map=None):
+    """
+    Tên hiển thị của mọi cặp/đội trong giải: {competitor_id: tên}.
+    Truyền lại comps (get_competitors) / members_map nếu caller đã có để không phải truy vấn lại.
+    """
+    if comps is None:
+        comps = get_competitors(t_id)
+    if members_map is None:
+        members_map = get_competitor_members_map(t_id)
+    return {
+        c["id"]: format_competitor_name(c["name"], c["kind"], [m[1] for m in members_map.get(c["id"], [])])
+        for c in comps
+    }
+
+# Kèm luôn tên các VĐV ra sân (giải đội, trận thường) -> vẽ danh sách trận không cần tra từng user
+SQL_MATCHES_BY_TOURNAMENT = """
+    SELECT
+        m.*,
+        c1.name AS name1,
+        c2.name AS name2,
+        u11.full_name AS team1_p1_name,
+        u12.full_name AS team1_p2_name,
+        u21.full_name AS team2_p1_name,
+        u22.full_name AS team2_p2_name
+    FROM matches m
+    JOIN competitors c1 ON c1.id = m.competitor1_id
+    JOIN competitors c2 ON c2.id = m.competitor2_id
+    LEFT JOIN users u11 ON u11.id = m.team1_p1_id
+    LEFT JOIN users u12 ON u12.id = m.team1_p2_id
+    LEFT JOIN users u21 ON u21.id = m.team2_p1_id
+    LEFT JOIN users u22 ON u22.id = m.team2_p2_id
+    WHERE m.tournament_id = ?
+    ORDER BY m.slot_no IS NULL, m.slot_no, m.court_no, m.id
+"""
+
 def get_matches(tournament_id):
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT m.*, c1.name AS name1, c2.name AS name2 FROM matches m JOIN competitors c1 ON c1.id = m.competitor1_id JOIN competitors c2 ON c2.id = m.competitor2_id WHERE m.tournament_id = ? ORDER BY m.id", (tournament_id,))
+    cur.execute(SQL_MATCHES_BY_TOURNAMENT, (tournament_id,))
     rows = cur.fetchall()
     conn.close()
     return rows
 
-# Tìm hàm add_match và thay thế bằng phiên bản này:
-def add_match(tournament_id, comp1_id, comp2_id, score1, score2, reporter_id, auto_confirm=True, team_players=None, match_type="standard"):
-    if score1 == score2:
-        st.warning("Hệ thống chưa hỗ trợ hoà.")
+# ------------------ Standings (BXH lưu sẵn) ------------------ #
+# Bảng standings giữ sẵn BXH của từng cặp/đội, cập nhật ngay trong giao dịch ghi trận:
+#   points / wins / pts_for / pts_against           : mọi trận đã xác nhận (compute_standings)
+#   pool_points / pool_wins / pool_pts_for / ...    : chỉ trận cùng bảng (compute_pool_standings)
+# Mọi đường thêm / sửa / xoá / xác nhận trận phải gọi _apply_match_to_standings
+# trong cùng giao dịch; đổi bảng của cặp/đội thì gọi _rebuild_standings cho giải.
+
+STANDINGS_FIELDS = ("points", "wins", "pts_for", "pts_against", "pool_points", "pool_wins", "pool_pts_for", "pool_pts_against")
+
+def _match_standings_deltas(m, pool_of):
+    """
+    Đóng góp của 1 trận vào BXH: {competitor_id: {field: delta}}.
+    pool_of: {competitor_id: pool_name} (ít nhất cho 2 đội của trận).
+    """
+    c1 = m["competitor1_id"]; c2 = m["competitor2_id"]; s1 = m["score1"]; s2 = m["score2"]
+    # Xác định điểm thưởng cho trận này
+    win_pts = 4 if (m["match_type"] or "standard") == "relay" else 2
+    p1 = pool_of.get(c1); p2 = pool_of.get(c2)
+    same_pool = p1 is not None and p1 == p2
+
+    deltas = {}
+    for cid, own, opp in ((c1, s1, s2), (c2, s2, s1)):
+        won = m["winner_id"] == cid
+        d = {
+            "points": win_pts if won else 0,
+            "wins": 1 if won else 0,
+            "pts_for": own,
+            "pts_against": opp,
+        }
+        for f in ("points", "wins", "pts_for", "pts_against"):
+            d["pool_" + f] = d[f] if same_pool else 0
+        deltas[cid] = d
+    return deltas
+
+def _apply_match_to_standings(cur, m, sign=1):
+    """Cộng (sign=1) hoặc trừ (sign=-1) 1 trận vào bảng standings. Trận chưa xác nhận / loại trực tiếp bị bỏ qua."""
+    if m["confirmed_by"] is None or m["stage"] == "knockout":
         return
+    cur.execute(
+        "SELECT id, pool_name FROM competitors WHERE id IN (?, ?)",
+        (m["competitor1_id"], m["competitor2_id"]),
+    )
+    pool_of = {r[0]: r[1] for r in cur.fetchall()}
+    _upsert_standings(cur, m["tournament_id"], _match_standings_deltas(m, pool_of), sign)
+
+def _upsert_standings(cur, tournament_id, deltas, sign=1):
+    """Cộng dồn {competitor_id: {field: delta}} vào bảng standings bằng 1 executemany."""
+    cur.executemany(
+        f"""
+        INSERT INTO standings (competitor_id, tournament_id, {", ".join(STANDINGS_FIELDS)})
+        VALUES (?, ?, {", ".join("?" * len(STANDINGS_FIELDS))})
+        ON CONFLICT(competitor_id) DO UPDATE SET
+            {", ".join(f"{f} = {f} + excluded.{f}" for f in STANDINGS_FIELDS)}
+        """,
+        [
+            (cid, tournament_id, *[sign * d[f] for f in STANDINGS_FIELDS])
+            for cid, d in deltas.items()
+        ],
+    )
+
+def _apply_bye_to_standings(cur, tournament_id, competitor_id, sign=1):
+    """Nghỉ lượt Swiss = 1 trận thắng 2 điểm, không có điểm ghi/thủng."""
+    cur.execute(
+        """
+        INSERT INTO standings (competitor_id, tournament_id, points, wins) VALUES (?, ?, ?, ?)
+        ON CONFLICT(competitor_id) DO UPDATE SET points = points + excluded.points, wins = wins + excluded.wins
+        """,
+        (competitor_id, tournament_id, 2 * sign, sign),
+    )
+
+# Tính BXH từ đầu hoàn toàn trong SQLite: UNION ALL 2 phía của mỗi trận đã xác nhận,
+# GROUP BY theo cặp/đội (bỏ trận loại trực tiếp); trận tiếp sức (relay) thắng được 4 điểm, trận thường 2 điểm.
+# Nghỉ lượt Swiss (swiss_byes) tính như 1 trận thắng 2 điểm. Cột pool_* chỉ cộng các trận 2 đội cùng bảng. Kết quả đã sắp: Điểm -> Hiệu số -> Tên.
+SQL_STANDINGS_FROM_MATCHES = """
+    WITH sides AS (
+        SELECT
+            m.competitor1_id AS competitor_id,
+            m.score1 AS own,
+            m.score2 AS opp,
+            m.winner_id = m.competitor1_id AS won,
+            CASE WHEN m.match_type = 'relay' THEN 4 ELSE 2 END AS win_pts,
+            c1.pool_name IS NOT NULL AND c1.pool_name = c2.pool_name AS same_pool
+        FROM matches m
+        JOIN competitors c1 ON c1.id = m.competitor1_id
+        JOIN competitors c2 ON c2.id = m.competitor2_id
+        WHERE m.tournament_id = :t AND m.confirmed_by IS NOT NULL AND m.stage = 'group'
+        UNION ALL
+        SELECT
+            m.competitor2_id,
+            m.score2,
+            m.score1,
+            m.winner_id = m.competitor2_id,
+            CASE WHEN m.match_type = 'relay' THEN 4 ELSE 2 END,
+            c1.pool_name IS NOT NULL AND c1.pool_name = c2.pool_name
+        FROM matches m
+        JOIN competitors c1 ON c1.id = m.competitor1_id
+        JOIN competitors c2 ON c2.id = m.competitor2_id
+        WHERE m.tournament_id = :t AND m.confirmed_by IS NOT NULL AND m.stage = 'group'
+        UNION ALL
+        SELECT b.competitor_id, 0, 0, 1, 2, 0
+        FROM swiss_byes b
+        WHERE b.tournament_id = :t
+    )
+    SELECT
+        c.id AS competitor_id,
+        c.tournament_id,
+        TOTAL(s.won * s.win_pts) AS points,
+        TOTAL(s.won) AS wins,
+        TOTAL(s.own) AS pts_for,
+        TOTAL(s.opp) AS pts_against,
+        TOTAL(s.same_pool * s.won * s.win_pts) AS pool_points,
+        TOTAL(s.same_pool * s.won) AS pool_wins,
+        TOTAL(s.same_pool * s.own) AS pool_pts_for,
+        TOTAL(s.same_pool * s.opp) AS pool_pts_against
+    FROM competitors c
+    LEFT JOIN sides s ON s.competitor_id = c.id
+    WHERE c.tournament_id = :t
+    GROUP BY c.id
+    ORDER BY points DESC, pts_for - pts_against DESC, c.name
+"""
+
+def _standings_from_matches(cur, tournament_id):
+    """Tính lại BXH từ đầu trên toàn bộ trận đã xác nhận: {competitor_id: {field: value}}."""
+    cur.execute(SQL_STANDINGS_FROM_MATCHES, {"t": tournament_id})
+    return {r["competitor_id"]: {f: int(r[f]) for f in STANDINGS_FIELDS} for r in cur.fetchall()}
+
+def _rebuild_standings(cur, tournament_id):
+    cur.execute("DELETE FROM standings WHERE tournament_id = ?", (tournament_id,))
+    cur.execute(
+        f"""
+        INSERT INTO standings (competitor_id, tournament_id, {", ".join(STANDINGS_FIELDS)})
+        SELECT competitor_id, tournament_id, {", ".join(f"CAST({f} AS INTEGER)" for f in STANDINGS_FIELDS)}
+        FROM ({SQL_STANDINGS_FROM_MATCHES})
+        """,
+        {"t": tournament_id},
+    )
+
+def rebuild_standings(tournament_id=None):
+    """Dựng lại bảng standings của 1 giải (hoặc mọi giải nếu tournament_id=None)."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    if tournament_id is None:
+        t_ids = [r[0] for r in cur.execute("SELECT id FROM tournaments").fetchall()]
+        cur.execute("DELETE FROM standings")
+    else:
+        t_ids = [tournament_id]
+    for t_id in t_ids:
+        _rebuild_standings(cur, t_id)
+    conn.commit()
+    conn.close()
+    invalidate(*[tournament_scope(t_id) for t_id in t_ids])
+
+def verify_standings(tournament_id):
+    """
+    Đối chiếu bảng standings với kết quả tính lại từ đầu.
+    Trả về danh sách sai lệch [{competitor_id, field, expected, stored}]; rỗng = khớp.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    expected = _standings_from_matches(cur, tournament_id)
+    cur.execute("SELECT * FROM standings WHERE tournament_id = ?", (tournament_id,))
+    stored = {r["competitor_id"]: {f: r[f] for f in STANDINGS_FIELDS} for r in cur.fetchall()}
+    conn.close()
+    zero = dict.fromkeys(STANDINGS_FIELDS, 0)
+    diffs = []
+    for cid in sorted(set(expected) | set(stored)):
+        exp = expected.get(cid, zero); got = stored.get(cid, zero)
+        for f in STANDINGS_FIELDS:
+            if exp[f] != got[f]:
+                diffs.append({"competitor_id": cid, "field": f, "expected": exp[f], "stored": got[f]})
+    return diffs
+
+def _record_match(cur, tournament_id, comp1_id, comp2_id, score1, score2, reporter_id, auto_confirm=True, team_players=None, match_type="standard", stage=None):
+    """
+    Ghi 1 kết quả trong giao dịch của caller (kèm cập nhật standings), trả về id trận.
+    Nếu 2 đội đang có trận trong lịch chưa đấu -> điền tỉ số vào trận đó, không tạo trận mới.
+    stage = 'group' / 'knockout': chỉ điền vào trận của vòng đó; None: ưu tiên trận loại trực tiếp đang chờ.
+    Trận loại trực tiếp chỉ có trong nhánh đấu -> không có trận chờ thì trả về None, không ghi gì.
+    """
     winner_id = comp1_id if score1 > score2 else comp2_id
     t1_p1, t1_p2, t2_p1, t2_p2 = team_players if team_players else (None, None, None, None)
-    
+    confirmed_by = reporter_id if auto_confirm else None
+
+    cur.execute("""
+        SELECT id, competitor1_id FROM matches
+        WHERE tournament_id = ? AND score1 IS NULL AND (? IS NULL OR stage = ?)
+          AND ((competitor1_id = ? AND competitor2_id = ?) OR (competitor1_id = ? AND competitor2_id = ?))
+        ORDER BY stage = 'knockout' DESC, round_no, id
+        LIMIT 1
+    """, (tournament_id, stage, stage, comp1_id, comp2_id, comp2_id, comp1_id))
+    fixture = cur.fetchone()
+
+    if fixture is None and stage == "knockout":
+        return None
+    if fixture is None:
+        cur.execute("""
+            INSERT INTO matches 
+            (tournament_id, competitor1_id, competitor2_id, score1, score2, winner_id, reported_by, confirmed_by, team1_p1_id, team1_p2_id, team2_p1_id, team2_p2_id, match_type) 
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (tournament_id, comp1_id, comp2_id, score1, score2, winner_id, reporter_id, confirmed_by, t1_p1, t1_p2, t2_p1, t2_p2, match_type))
+        match_id = cur.lastrowid
+    else:
+        match_id = fixture["id"]
+        if fixture["competitor1_id"] != comp1_id:
+            # Lịch ghi ngược chiều -> đảo tỉ số / đội hình cho khớp
+            score1, score2 = score2, score1
+            t1_p1, t1_p2, t2_p1, t2_p2 = t2_p1, t2_p2, t1_p1, t1_p2
+        cur.execute("""
+            UPDATE matches
+            SET score1 = ?, score2 = ?, winner_id = ?, reported_by = ?, confirmed_by = ?,
+                team1_p1_id = ?, team1_p2_id = ?, team2_p1_id = ?, team2_p2_id = ?, match_type = ?
+            WHERE id = ?
+        """, (score1, score2, winner_id, reporter_id, confirmed_by, t1_p1, t1_p2, t2_p1, t2_p2, match_type, match_id))
+
+    cur.execute("SELECT * FROM matches WHERE id = ?", (match_id,))
+    m = cur.fetchone()
+    _apply_match_to_standings(cur, m)
+    _advance_bracket(cur, m)
+    return match_id
+
+# Tìm hàm add_match và thay thế bằng phiên bản này:
+def add_match(tournament_id, comp1_id, comp2_id, score1, score2, reporter_id, auto_confirm=True, team_players=None, match_type="standard", stage=None):
+    """Ghi 1 kết quả (xem _record_match). Trả về id trận, hoặc None nếu không ghi."""
+    if score1 == score2:
+        st.warning("Hệ thống chưa hỗ trợ hoà.")
+        return None
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    match_id = _record_match(cur, tournament_id, comp1_id, comp2_id, score1, score2, reporter_id, auto_confirm, team_players, match_type, stage)
+    if match_id is None:
+        conn.rollback(); conn.close()
+        st.warning("Hai đội không có trận loại trực tiếp nào đang chờ.")
+        return None
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(tournament_id))
+    return match_id
+
+def delete_match(match_id):
+    """
+    Xoá trận (trận loại trực tiếp: chỉ xoá kết quả).
+    Trả về False nếu không xoá được vì trận vòng sau của nhánh đấu đã có kết quả.
+    """
     conn = get_conn()
     cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("SELECT * FROM matches WHERE id = ?", (match_id,))
+    m = cur.fetchone()
+    if m is None:
+        # Trận đã bị xoá trước đó
+        conn.rollback(); conn.close()
+        return True
+    if m["stage"] == "knockout":
+        # Trận loại trực tiếp thuộc nhánh đấu -> chỉ xoá kết quả, giữ lại trận
+        if not _retract_bracket(cur, m):
+            conn.rollback(); conn.close()
+            return False
+        cur.execute("""
+            UPDATE matches
+            SET score1 = NULL, score2 = NULL, winner_id = NULL, reported_by = NULL, confirmed_by = NULL,
+                team1_p1_id = NULL, team1_p2_id = NULL, team2_p1_id = NULL, team2_p2_id = NULL
+            WHERE id = ?
+        """, (match_id,))
+    else:
+        _apply_match_to_standings(cur, m, sign=-1)
+        cur.execute("DELETE FROM matches WHERE id = ?", (match_id,))
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(m["tournament_id"]))
+    return True
+
+# ------------------ Nhập nhiều kết quả ------------------ #
+
+BULK_COLUMNS = ("team1", "team2", "score1", "score2", "match_type", "lineup1", "lineup2")
+
+def parse_results_text(text):
+    """
+    Đọc kết quả dán từ CSV / bảng tính: mỗi dòng "Đội 1, Đội 2, Điểm 1, Điểm 2[, Loại trận, VĐV đội 1, VĐV đội 2]".
+    Tự nhận dấu phân cách (tab khi dán từ bảng tính, ; hoặc ,); bỏ dòng tiêu đề nếu có.
+    """
+    lines = [ln for ln in (text or "").splitlines() if ln.strip()]
+    if not lines:
+        return []
+    delim = "\t" if "\t" in lines[0] else (";" if ";" in lines[0] else ",")
+    rows = [[f.strip() for f in r] for r in csv.reader(lines, delimiter=delim)]
+    if rows and len(rows[0]) >= 3 and _parse_score(rows[0][2]) is None:
+        rows = rows[1:]  # dòng tiêu đề
+    return [dict(zip(BULK_COLUMNS, r)) for r in rows]
+
+def _parse_score(value):
+    if _cell_text(value) == "":
+        return None
+    try:
+        f = float(_cell_text(value))
+    except ValueError:
+        return None
+    return int(f) if f == f and f.is_integer() and f >= 0 else None
+
+def _cell_text(value):
+    # Ô trống của bảng nhập có thể là None hoặc NaN
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    return str(value).strip()
+
+def validate_bulk_results(rows, c_map, m_map, ctype="pair"):
+    """
+    Kiểm tra toàn bộ dòng nhập trước khi ghi.
+    - rows: [{team1, team2, score1, score2, match_type, lineup1, lineup2}] (giá trị thô từ bảng / CSV)
+    - c_map: {tên hiển thị viết thường: competitor_id}; m_map: get_competitor_members_map
+    Dòng chưa có tỉ số được bỏ qua. Trả về (results cho add_matches_bulk, errors).
+    """
+    results = []
+    errors = []
+    for i, row in enumerate(rows, start=1):
+        t1 = _cell_text(row.get("team1")); t2 = _cell_text(row.get("team2"))
+        raw1 = row.get("score1"); raw2 = row.get("score2")
+        if _cell_text(raw1) == "" and _cell_text(raw2) == "":
+            continue  # trận chưa đấu
+
+        cid1 = c_map.get(t1.lower()); cid2 = c_map.get(t2.lower())
+        s1 = _parse_score(raw1); s2 = _parse_score(raw2)
+        row_errors = []
+        if cid1 is None: row_errors.append(f"không tìm thấy đội '{t1}'")
+        if cid2 is None: row_errors.append(f"không tìm thấy đội '{t2}'")
+        if cid1 is not None and cid1 == cid2: row_errors.append("trùng đội")
+        if s1 is None or s2 is None: row_errors.append("tỉ số phải là số nguyên ≥ 0")
+        elif s1 == s2: row_errors.append("hệ thống chưa hỗ trợ hoà")
+
+        mt_raw = _cell_text(row.get("match_type")).lower()
+        match_type = "relay" if ("tiếp sức" in mt_raw or "relay" in mt_raw) else "standard"
+        team_players = None
+        if ctype == "team" and match_type == "standard" and cid1 is not None and cid2 is not None:
+            lineup = []
+            for cid, team, raw in ((cid1, t1, row.get("lineup1")), (cid2, t2, row.get("lineup2"))):
+                by_name = {n.lower(): uid for uid, n in m_map.get(cid, [])}
+                names = [n.strip().lower() for n in re.split(r"[+/&,;]", _cell_text(raw)) if n.strip()]
+                uids = [by_name.get(n) for n in names]
+                if len(uids) != 2 or None in uids or uids[0] == uids[1]:
+                    row_errors.append(f"cần đúng 2 VĐV của '{team}'")
+                lineup += uids[:2] + [None] * (2 - len(uids[:2]))
+            team_players = tuple(lineup)
+
+        if row_errors:
+            errors.append(f"Dòng {i}: " + "; ".join(row_errors))
+        else:
+            results.append({
+                "comp1_id": cid1, "comp2_id": cid2, "score1": s1, "score2": s2,
+                "match_type": match_type, "team_players": team_players,
+            })
+    return results, errors
+
+def add_matches_bulk(tournament_id, results, reporter_id):
+    """
+    Ghi nhiều kết quả (đã qua validate_bulk_results) trong 1 giao dịch.
+    Kết quả trùng trận trong lịch thì điền vào trận đó, còn lại chèn mới – mỗi loại 1 executemany;
+    standings được cộng dồn rồi ghi 1 lần. Trả về số trận đã ghi.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
     cur.execute("""
-        INSERT INTO matches 
-        (tournament_id, competitor1_id, competitor2_id, score1, score2, winner_id, reported_by, confirmed_by, team1_p1_id, team1_p2_id, team2_p1_id, team2_p2_id, match_type) 
+        SELECT id, competitor1_id, competitor2_id, stage FROM matches
+        WHERE tournament_id = ? AND score1 IS NULL
+        ORDER BY stage = 'knockout' DESC, round_no, id
+    """, (tournament_id,))
+    open_fixtures = {}
+    for r in cur.fetchall():
+        open_fixtures.setdefault(frozenset((r[1], r[2])), []).append(dict(r))
+    cur.execute("SELECT id, pool_name FROM competitors WHERE tournament_id = ?", (tournament_id,))
+    pool_of = {r[0]: r[1] for r in cur.fetchall()}
+
+    update_sql = """
+        UPDATE matches
+        SET score1 = ?, score2 = ?, winner_id = ?, reported_by = ?, confirmed_by = ?,
+            team1_p1_id = ?, team1_p2_id = ?, team2_p1_id = ?, team2_p2_id = ?, match_type = ?
+        WHERE id = ?
+    """
+    updates = []; inserts = []; totals = {}
+    for res in results:
+        c1, c2, s1, s2 = res["comp1_id"], res["comp2_id"], res["score1"], res["score2"]
+        winner_id = c1 if s1 > s2 else c2
+        tp = res.get("team_players") or (None, None, None, None)
+        match_type = res.get("match_type") or "standard"
+        pending = open_fixtures.get(frozenset((c1, c2)))
+        fixture = pending.pop(0) if pending else None
+        if fixture is not None and fixture["competitor1_id"] != c1:
+            c1, c2, s1, s2 = c2, c1, s2, s1
+            tp = (tp[2], tp[3], tp[0], tp[1])
+        row = (s1, s2, winner_id, reporter_id, reporter_id, *tp, match_type)
+
+        if fixture is not None and fixture["stage"] == "knockout":
+            # Trận loại trực tiếp ghi ngay để đội thắng đi tiếp (có thể mở trận vòng sau trong cùng lô)
+            cur.execute(update_sql, (*row, fixture["id"]))
+            opened = _advance_bracket(cur, {"id": fixture["id"], "stage": "knockout", "confirmed_by": reporter_id, "winner_id": winner_id})
+            if opened is not None:
+                # Trận loại trực tiếp vừa mở được ưu tiên như các trận loại trực tiếp khác
+                open_fixtures.setdefault(frozenset((opened["competitor1_id"], opened["competitor2_id"])), []).insert(0, opened)
+            continue
+        if fixture is not None:
+            updates.append((*row, fixture["id"]))
+        else:
+            inserts.append((tournament_id, c1, c2, *row))
+        m = {"competitor1_id": c1, "competitor2_id": c2, "score1": s1, "score2": s2, "winner_id": winner_id, "match_type": match_type}
+        for cid, d in _match_standings_deltas(m, pool_of).items():
+            acc = totals.setdefault(cid, dict.fromkeys(STANDINGS_FIELDS, 0))
+            for f in STANDINGS_FIELDS:
+                acc[f] += d[f]
+
+    cur.executemany(update_sql, updates)
+    cur.executemany("""
+        INSERT INTO matches
+        (tournament_id, competitor1_id, competitor2_id, score1, score2, winner_id, reported_by, confirmed_by, team1_p1_id, team1_p2_id, team2_p1_id, team2_p2_id, match_type)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (tournament_id, comp1_id, comp2_id, score1, score2, winner_id, reporter_id, reporter_id if auto_confirm else None, t1_p1, t1_p2, t2_p1, t2_p2, match_type))
+    """, inserts)
+    _upsert_standings(cur, tournament_id, totals)
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(tournament_id))
+    return len(results)
+
+# ------------------ Lịch thi đấu vòng tròn ------------------ #
+# Trận trong lịch = dòng matches chưa có tỉ số (score1/score2/winner_id = NULL).
+# Khi nhập kết quả (add_match) cho 2 đội đã có lịch, tỉ số được điền vào đúng trận đó.
+
+def round_robin_rounds(items):
+    """
+    Chia lượt vòng tròn bằng phương pháp xoay vòng (circle method).
+    Trả về [[(a, b), ...], ...] – mỗi phần tử là 1 lượt, mỗi đội đấu tối đa 1 trận / lượt.
+    """
+    items = list(items)
+    if len(items) < 2:
+        return []
+    if len(items) % 2 == 1:
+        items.append(None)  # đội "nghỉ" (bye)
+    n = len(items)
+    rounds = []
+    for r in range(n - 1):
+        pairs = []
+        for i in range(n // 2):
+            a, b = items[i], items[n - 1 - i]
+            if a is None or b is None:
+                continue
+            # Đổi chiều xen kẽ để đội cố định không luôn đứng bên trái
+            pairs.append((b, a) if (i == 0 and r % 2 == 1) else (a, b))
+        rounds.append(pairs)
+        # Giữ cố định phần tử đầu, xoay các phần tử còn lại
+        items = [items[0], items[-1]] + items[1:-1]
+    return rounds
+
+def generate_round_robin(tournament_id):
+    """
+    Tạo lịch vòng tròn cho từng bảng (hoặc cả giải nếu không phân bảng).
+    Lịch chưa đấu cũ bị thay thế; cặp đã có kết quả thì không xếp lại.
+    Toàn bộ trận được ghi bằng 1 executemany trong 1 giao dịch. Trả về số trận đã tạo.
+    """
+    t = get_tournament_by_id(tournament_id)
+    use_pools = bool(t["use_pools"])
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("DELETE FROM matches WHERE tournament_id = ? AND score1 IS NULL AND stage = 'group'", (tournament_id,))
+    cur.execute("SELECT competitor1_id, competitor2_id FROM matches WHERE tournament_id = ? AND stage = 'group'", (tournament_id,))
+    played = {frozenset((r[0], r[1])) for r in cur.fetchall()}
+
+    cur.execute("SELECT id, pool_name FROM competitors WHERE tournament_id = ? ORDER BY id", (tournament_id,))
+    groups = {}
+    for r in cur.fetchall():
+        if use_pools and not r["pool_name"]:
+            continue  # chưa được xếp bảng
+        groups.setdefault(r["pool_name"] if use_pools else None, []).append(r["id"])
+
+    fixtures = []
+    for ids in groups.values():
+        for round_no, pairs in enumerate(round_robin_rounds(ids), start=1):
+            for a, b in pairs:
+                if frozenset((a, b)) not in played:
+                    fixtures.append((tournament_id, a, b, round_no))
+    cur.executemany(
+        "INSERT INTO matches (tournament_id, competitor1_id, competitor2_id, round_no) VALUES (?, ?, ?, ?)",
+        fixtures,
+    )
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(tournament_id))
+    return len(fixtures)
+
+# ------------------ Hệ Swiss ------------------ #
+# Giải có pairing_system = 'swiss' không xếp vòng tròn: mỗi lượt ghép cặp theo BXH hiện tại
+# (compute_standings). Không có màu sân nên chỉ cần: cùng nhóm điểm, không tái đấu,
+# đội lẻ nhóm được "thả" (float) xuống nhóm dưới; nghỉ lượt (bye) tính như 1 trận thắng.
+
+def _pair_score_group(pool, played):
+    """
+    Ghép trong 1 nhóm điểm kiểu Dutch: nửa trên gặp nửa dưới, tránh cặp đã gặp.
+    pool theo thứ tự BXH. Trả về (pairs, unpaired) – unpaired sẽ được thả xuống nhóm dưới.
+    """
+    half = len(pool) // 2
+    top, bottom = pool[:half], pool[half:]
+    used = set()
+    pairs = []
+    leftovers = []
+    for a in top:
+        for b in bottom:
+            if b not in used and frozenset((a, b)) not in played:
+                used.add(b)
+                pairs.append((a, b))
+                break
+        else:
+            leftovers.append(a)
+    leftovers += [b for b in bottom if b not in used]
+
+    # Ghép nốt những đội còn lại trong nhóm với nhau (vẫn tránh tái đấu)
+    unpaired = []
+    while leftovers:
+        a = leftovers.pop(0)
+        b = next((x for x in leftovers if frozenset((a, x)) not in played), None)
+        if b is None:
+            unpaired.append(a)
+        else:
+            leftovers.remove(b)
+            pairs.append((a, b))
+    return pairs, unpaired
+
+def swiss_pairings(ranking, scores, played, byes_had=()):
+    """
+    Ghép cặp 1 lượt Swiss.
+    - ranking: [competitor_id] theo BXH hiện tại (cao -> thấp); scores: {competitor_id: điểm}
+    - played: set(frozenset((a, b))) các cặp đã gặp; byes_had: các đội đã được nghỉ lượt
+    Trả về (pairs [(a, b)], bye_id hoặc None).
+    """
+    players = list(ranking)
+    bye = None
+    if len(players) % 2:
+        # Nghỉ lượt: đội hạng thấp nhất chưa từng được nghỉ
+        candidates = [p for p in players if p not in byes_had] or players
+        bye = candidates[-1]
+        players.remove(bye)
+
+    pairs = []
+    floaters = []
+    for score in sorted({scores.get(p, 0) for p in players}, reverse=True):
+        pool = floaters + [p for p in players if scores.get(p, 0) == score]
+        group_pairs, floaters = _pair_score_group(pool, played)
+        pairs += group_pairs
+
+    if floaters:
+        # Greedy bị kẹt (nhóm cuối toàn cặp đã gặp): tìm đường tăng (Edmonds) từ cách ghép hiện có,
+        # chỉ đổi chéo dọc theo đường đi nên phần lớn các cặp cùng nhóm điểm được giữ nguyên
+        pairs = _repair_pairings(players, scores, played, pairs)
+    return pairs, bye
+
+def _augment_matching(adj, match):
+    """
+    Ghép cặp cực đại trên đồ thị tổng quát (thuật toán blossom của Edmonds, O(V^3)),
+    xuất phát từ cách ghép có sẵn `match` (match[v] = đỉnh ghép với v hoặc -1).
+    """
+    n = len(adj)
+
+    def find_path(root):
+        used = [False] * n
+        parent = [-1] * n
+        base = list(range(n))
+        used[root] = True
+        queue = [root]
+
+        def lca(a, b):
+            seen = [False] * n
+            while True:
+                a = base[a]; seen[a] = True
+                if match[a] == -1: break
+                a = parent[match[a]]
+            while True:
+                b = base[b]
+                if seen[b]: return b
+                b = parent[match[b]]
+
+        def mark_path(v, b, child, blossom):
+            while base[v] != b:
+                blossom[base[v]] = blossom[base[match[v]]] = True
+                parent[v] = child
+                child = match[v]
+                v = parent[match[v]]
+
+        qi = 0
+        while qi < len(queue):
+            v = queue[qi]; qi += 1
+            for to in adj[v]:
+                if base[v] == base[to] or match[v] == to:
+                    continue
+                if to == root or (match[to] != -1 and parent[match[to]] != -1):
+                    cur_base = lca(v, to)
+                    blossom = [False] * n
+                    mark_path(v, cur_base, to, blossom)
+                    mark_path(to, cur_base, v, blossom)
+                    for i in range(n):
+                        if blossom[base[i]]:
+                            base[i] = cur_base
+                            if not used[i]:
+                                used[i] = True; queue.append(i)
+                elif parent[to] == -1:
+                    parent[to] = v
+                    if match[to] == -1:
+                        return to, parent
+                    used[match[to]] = True; queue.append(match[to])
+        return -1, parent
+
+    for v in range(n):
+        if match[v] != -1:
+            continue
+        to, parent = find_path(v)
+        while to != -1:
+            pv = parent[to]; nxt = match[pv]
+            match[to] = pv; match[pv] = to
+            to = nxt
+    return match
+
+def _repair_pairings(players, scores, played, pairs):
+    idx = {p: i for i, p in enumerate(players)}
+    # Ưu tiên đối thủ gần điểm / gần hạng nhất khi tìm đường tăng
+    adj = [
+        sorted(
+            (idx[q] for q in players if q != p and frozenset((p, q)) not in played),
+            key=lambda j: (abs(scores.get(players[j], 0) - scores.get(p, 0)), abs(j - idx[p])),
+        )
+        for p in players
+    ]
+    match = [-1] * len(players)
+    for a, b in pairs:
+        match[idx[a]] = idx[b]; match[idx[b]] = idx[a]
+    _augment_matching(adj, match)
+
+    result = [(players[i], players[j]) for i, j in enumerate(match) if i < j]
+    # Không tránh được tái đấu (giải quá ít đội so với số lượt): ghép nốt theo thứ tự BXH
+    left = [p for i, p in enumerate(players) if match[i] == -1]
+    result += list(zip(left[::2], left[1::2]))
+    return sorted(result, key=lambda ab: min(idx[ab[0]], idx[ab[1]]))
+
+def generate_swiss_round(tournament_id):
+    """
+    Xếp lượt Swiss tiếp theo từ BXH hiện tại; trận được ghi vào matches với round_no của lượt.
+    Trả về (round_no, số trận, bye_id), hoặc None nếu lượt trước còn trận chưa đấu.
+    """
+    standings = compute_standings(tournament_id)
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute(
+        "SELECT competitor1_id, competitor2_id, score1, round_no FROM matches WHERE tournament_id = ? AND stage = 'group'",
+        (tournament_id,),
+    )
+    rows = cur.fetchall()
+    if any(r["score1"] is None for r in rows):
+        conn.rollback(); conn.close()
+        return None
+    played = {frozenset((r[0], r[1])) for r in rows}
+    cur.execute("SELECT competitor_id, round_no FROM swiss_byes WHERE tournament_id = ?", (tournament_id,))
+    byes = cur.fetchall()
+    round_no = max([r["round_no"] or 0 for r in rows] + [b["round_no"] for b in byes] + [0]) + 1
+
+    pairs, bye = swiss_pairings(
+        [s["id"] for s in standings],
+        {s["id"]: s["points"] for s in standings},
+        played,
+        {b["competitor_id"] for b in byes},
+    )
+    cur.executemany(
+        "INSERT INTO matches (tournament_id, competitor1_id, competitor2_id, round_no) VALUES (?, ?, ?, ?)",
+        [(tournament_id, a, b, round_no) for a, b in pairs],
+    )
+    if bye is not None:
+        cur.execute(
+            "INSERT INTO swiss_byes (tournament_id, round_no, competitor_id) VALUES (?, ?, ?)",
+            (tournament_id, round_no, bye),
+        )
+        _apply_bye_to_standings(cur, tournament_id, bye)
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(tournament_id))
+    return round_no, len(pairs), bye
+
+def schedule_courts(fixtures, players_of, num_courts, min_rest=0):
+    """
+    Xếp sân + khung giờ cho các trận (tham lam theo từng khung giờ, lấp đầy sân tối đa).
+    - fixtures: [(match_id, competitor1_id, competitor2_id, round_no)] theo thứ tự ưu tiên
+    - players_of: {competitor_id: set(user_id)} – 1 VĐV không bao giờ ở 2 sân cùng lúc
+      (kể cả khi thuộc nhiều cặp/đội), và phải nghỉ ít nhất `min_rest` khung giờ giữa 2 trận.
+    Trả về ({match_id: (court_no, slot_no)}, makespan = số khung giờ cần dùng); sân/khung giờ đánh số từ 1.
+    """
+    num_courts = max(1, int(num_courts))
+    # Đội còn nhiều trận hơn được ưu tiên xếp sớm để không kéo dài lịch
+    load = {}
+    for _, c1, c2, _ in fixtures:
+        load[c1] = load.get(c1, 0) + 1
+        load[c2] = load.get(c2, 0) + 1
+    remaining = sorted(
+        fixtures,
+        key=lambda f: (f[3] or 0, -max(load[f[1]], load[f[2]])),
+    )
+    fixture_players = {
+        f[0]: players_of.get(f[1], set()) | players_of.get(f[2], set()) for f in remaining
+    }
+
+    last_slot = {}  # user_id -> khung giờ thi đấu gần nhất
+    assignment = {}
+    slot = 0
+    while remaining:
+        slot += 1
+        busy = set()
+        court = 0
+        left = []
+        for f in remaining:
+            if court >= num_courts:
+                left.append(f)
+                continue
+            players = fixture_players[f[0]]
+            if busy.isdisjoint(players) and all(
+                slot - last_slot.get(u, -min_rest - 1) > min_rest for u in players
+            ):
+                court += 1
+                assignment[f[0]] = (court, slot)
+                busy |= players
+            else:
+                left.append(f)
+        for u in busy:
+            last_slot[u] = slot
+        remaining = left
+    return assignment, (max(s for _, s in assignment.values()) if assignment else 0)
+
+def assign_courts(tournament_id, min_rest=0):
+    """
+    Xếp sân / khung giờ cho mọi trận chưa đấu của giải theo tournaments.num_courts.
+    Trả về (số trận đã xếp, makespan).
+    """
+    t = get_tournament_by_id(tournament_id)
+    num_courts = t["num_courts"] or 4
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute(
+        "SELECT id, competitor1_id, competitor2_id, round_no FROM matches "
+        "WHERE tournament_id = ? AND score1 IS NULL ORDER BY round_no, id",
+        (tournament_id,),
+    )
+    fixtures = [tuple(r) for r in cur.fetchall()]
+    cur.execute(
+        "SELECT cm.competitor_id, cm.user_id FROM competitors c "
+        "JOIN competitor_members cm ON cm.competitor_id = c.id WHERE c.tournament_id = ?",
+        (tournament_id,),
+    )
+    players_of = {}
+    for cid, uid in cur.fetchall():
+        players_of.setdefault(cid, set()).add(uid)
+
+    assignment, makespan = schedule_courts(fixtures, players_of, num_courts, min_rest)
+    cur.executemany(
+        "UPDATE matches SET court_no = ?, slot_no = ? WHERE id = ?",
+        [(court, slot, mid) for mid, (court, slot) in assignment.items()],
+    )
     conn.commit()
     conn.close()
+    invalidate(tournament_scope(tournament_id))
+    return len(assignment), makespan
 
+def clear_unplayed_fixtures(tournament_id):
+    # Chỉ xoá lịch vòng bảng; trận loại trực tiếp do nhánh đấu quản lý
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM matches WHERE tournament_id = ? AND score1 IS NULL AND stage = 'group'", (tournament_id,))
+    # Lượt Swiss không còn trận nào -> huỷ luôn lượt nghỉ của lượt đó
+    cur.execute("""
+        SELECT round_no, competitor_id FROM swiss_byes
+        WHERE tournament_id = ? AND round_no NOT IN (
+            SELECT round_no FROM matches WHERE tournament_id = ? AND stage = 'group' AND round_no IS NOT NULL
+        )
+    """, (tournament_id, tournament_id))
+    for b in cur.fetchall():
+        _apply_bye_to_standings(cur, tournament_id, b["competitor_id"], sign=-1)
+        cur.execute("DELETE FROM swiss_byes WHERE tournament_id = ? AND round_no = ?", (tournament_id, b["round_no"]))
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(tournament_id))
+
+SQL_STANDINGS = """
+    SELECT
+        c.id,
+        c.name,
+        COALESCE(s.points, 0) AS points,
+        COALESCE(s.wins, 0) AS wins,
+        COALESCE(s.pts_for, 0) AS pts_for,
+        COALESCE(s.pts_against, 0) AS pts_against,
+        COALESCE(s.pts_for - s.pts_against, 0) AS diff
+    FROM competitors c
+    LEFT JOIN standings s ON s.competitor_id = c.id
+    WHERE c.tournament_id = ?
+    ORDER BY points DESC, diff DESC, c.name
+"""
+
+@cached_derived(lambda tournament_id: [tournament_scope(tournament_id)])
 def compute_standings(tournament_id):
+    # Đọc từ bảng standings lưu sẵn, đã sắp theo: Điểm số -> Hiệu số -> Tên
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT c.id, c.name FROM competitors c WHERE c.tournament_id = ?", (tournament_id,))
-    # Thêm trường 'points' để tính điểm xếp hạng
-    competitors = {r["id"]: {"name": r["name"], "wins": 0, "points": 0, "pts_for": 0, "pts_against": 0} for r in cur.fetchall()}
-    
-    cur.execute("SELECT * FROM matches WHERE tournament_id = ? AND confirmed_by IS NOT NULL", (tournament_id,))
-    for m in cur.fetchall():
-        c1 = m["competitor1_id"]; c2 = m["competitor2_id"]; s1 = m["score1"]; s2 = m["score2"]
-        # Xác định điểm thưởng cho trận này
-        m_type = m["match_type"] if "match_type" in m.keys() and m["match_type"] else "standard"
-        win_pts = 4 if m_type == "relay" else 2
-        
-        competitors[c1]["pts_for"] += s1; competitors[c1]["pts_against"] += s2
-        competitors[c2]["pts_for"] += s2; competitors[c2]["pts_against"] += s1
-        
-        if m["winner_id"] == c1: 
-            competitors[c1]["wins"] += 1
-            competitors[c1]["points"] += win_pts
-        elif m["winner_id"] == c2: 
-            competitors[c2]["wins"] += 1
-            competitors[c2]["points"] += win_pts
-            
+    cur.execute(SQL_STANDINGS, (tournament_id,))
+    table = [dict(r) for r in cur.fetchall()]
     conn.close()
-    table = []
-    for cid, info in competitors.items():
-        table.append({
-            "id": cid, 
-            "name": info["name"], 
-            "points": info["points"], # Điểm xếp hạng
-            "wins": info["wins"],     # Số trận thắng
-            "pts_for": info["pts_for"], 
-            "pts_against": info["pts_against"], 
-            "diff": info["pts_for"] - info["pts_against"]
-        })
-    # Sắp xếp theo: Điểm số -> Hiệu số -> Tên
-    table.sort(key=lambda x: (-x["points"], -x["diff"], x["name"]))
     return table
 
+SQL_POOL_STANDINGS = """
+    SELECT
+        c.id,
+        c.name,
+        c.pool_name,
+        COALESCE(s.pool_points, 0) AS points,
+        COALESCE(s.pool_wins, 0) AS wins,
+        COALESCE(s.pool_pts_for, 0) AS pts_for,
+        COALESCE(s.pool_pts_against, 0) AS pts_against,
+        COALESCE(s.pool_pts_for - s.pool_pts_against, 0) AS diff
+    FROM competitors c
+    LEFT JOIN standings s ON s.competitor_id = c.id
+    WHERE c.tournament_id = ? AND c.pool_name IS NOT NULL
+    ORDER BY c.pool_name, points DESC, diff DESC, c.name
+"""
+
+@cached_derived(lambda tournament_id: [tournament_scope(tournament_id)])
 def compute_pool_standings(tournament_id):
+    # Chỉ tính trận cùng bảng; trận giữa 2 bảng khác nhau (vd. vòng loại trực tiếp) bị loại
     conn = get_conn()
     cur = conn.cursor()
-    cur.execute("SELECT id, name, pool_name FROM competitors WHERE tournament_id = ? AND pool_name IS NOT NULL", (tournament_id,))
-    comps = cur.fetchall()
-    if not comps: conn.close(); return {}
-    pool_map = {}
-    for c in comps:
-        pool = c["pool_name"]
-        pool_map.setdefault(pool, {})
-        # Thêm field 'points'
-        pool_map[pool][c["id"]] = {"id": c["id"], "name": c["name"], "wins": 0, "points": 0, "pts_for": 0, "pts_against": 0, "diff": 0}
-    
-    cur.execute("SELECT * FROM matches WHERE tournament_id = ? AND confirmed_by IS NOT NULL", (tournament_id,))
-    matches = cur.fetchall()
-    for m in matches:
-        c1 = m["competitor1_id"]; c2 = m["competitor2_id"]; s1 = m["score1"]; s2 = m["score2"]
-        
-        m_type = m["match_type"] if "match_type" in m.keys() and m["match_type"] else "standard"
-        win_pts = 4 if m_type == "relay" else 2
-
-        for pool, comp_dict in pool_map.items():
-            if c1 in comp_dict and c2 in comp_dict:
-                comp_dict[c1]["pts_for"] += s1; comp_dict[c1]["pts_against"] += s2
-                comp_dict[c2]["pts_for"] += s2; comp_dict[c2]["pts_against"] += s1
-                
-                if m["winner_id"] == c1: 
-                    comp_dict[c1]["wins"] += 1
-                    comp_dict[c1]["points"] += win_pts
-                elif m["winner_id"] == c2: 
-                    comp_dict[c2]["wins"] += 1
-                    comp_dict[c2]["points"] += win_pts
-                break
-    conn.close()
+    cur.execute(SQL_POOL_STANDINGS, (tournament_id,))
     result = {}
-    for pool, comp_dict in pool_map.items():
-        lst = []
-        for cid, info in comp_dict.items():
-            info["diff"] = info["pts_for"] - info["pts_against"]
-            lst.append(info)
-        # Sắp xếp theo: Điểm số -> Hiệu số -> Tên
-        lst.sort(key=lambda x: (-x["points"], -x["diff"], x["name"]))
-        result[pool] = lst
+    for r in cur.fetchall():
+        info = dict(r)
+        pool = info.pop("pool_name")
+        result.setdefault(pool, []).append(info)
+    conn.close()
     return result
 
+SQL_CROSS_POOL_MATCH_COUNT = """
+    SELECT COUNT(*)
+    FROM matches m
+    JOIN competitors c1 ON c1.id = m.competitor1_id
+    JOIN competitors c2 ON c2.id = m.competitor2_id
+    WHERE m.tournament_id = ?
+      AND m.confirmed_by IS NOT NULL
+      AND m.stage = 'group'
+      AND (c1.pool_name IS NULL OR c2.pool_name IS NULL OR c1.pool_name != c2.pool_name)
+"""
+
+@cached_derived(lambda tournament_id: [tournament_scope(tournament_id)])
+def count_cross_pool_matches(tournament_id):
+    """Số trận đã xác nhận giữa 2 bảng khác nhau (không được tính vào BXH bảng)."""
+    conn = get_conn()
+    count = conn.execute(SQL_CROSS_POOL_MATCH_COUNT, (tournament_id,)).fetchone()[0]
+    conn.close()
+    return count
+
+# ------------------ Lịch sử đồng đội ------------------ #
+
+# Các lần 2 VĐV của giải từng đánh cặp với nhau ở giải khác (đi từ index competitor_members.user_id)
+SQL_PARTNER_HISTORY = """
+    SELECT a.user_id AS u1, b.user_id AS u2, COUNT(*) AS times, MAX(c.tournament_id) AS last_tournament_id
+    FROM tournament_players tp
+    JOIN competitor_members a ON a.user_id = tp.user_id
+    JOIN competitor_members b ON b.competitor_id = a.competitor_id AND b.user_id > a.user_id
+    JOIN competitors c ON c.id = a.competitor_id
+    WHERE tp.tournament_id = ? AND tp.status = 'approved'
+      AND c.kind = 'pair' AND c.tournament_id != ?
+    GROUP BY a.user_id, b.user_id
+"""
+
+def get_partner_history(tournament_id):
+    """
+    Lịch sử đồng đội của các VĐV trong giải, tính 1 lần cho mỗi lần bốc thăm:
+    {frozenset((u1, u2)): (số lần đánh cặp, số giải đã qua kể từ lần gần nhất)}.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM tournaments ORDER BY id DESC")
+    recency = {r[0]: i for i, r in enumerate(cur.fetchall())}
+    cur.execute(SQL_PARTNER_HISTORY, (tournament_id, tournament_id))
+    history = {
+        frozenset((r["u1"], r["u2"])): (r["times"], recency.get(r["last_tournament_id"], len(recency)))
+        for r in cur.fetchall()
+    }
+    conn.close()
+    return history
+
+# ------------------ Vòng loại trực tiếp (knockout) ------------------ #
+# Nhánh đấu lưu trong bracket_nodes: mỗi nút = 1 trận (round_no, slot), thắng ở nút
+# (r, slot) đi tiếp vào nút (r + 1, slot // 2), phía slot % 2 + 1.
+# Trận loại trực tiếp là dòng matches có stage = 'knockout' -> không tính vào BXH bảng.
+
+def bracket_seed_order(size):
+    """Thứ tự hạt giống theo vị trí nhánh đấu chuẩn, vd. size=8 -> [1, 8, 4, 5, 2, 7, 3, 6]."""
+    order = [1]
+    while len(order) < size:
+        n = len(order) * 2
+        order = [x for s in order for x in (s, n + 1 - s)]
+    return order
+
+def bracket_round_name(round_no, total_rounds):
+    left = total_rounds - round_no
+    if left == 0: return "Chung kết"
+    if left == 1: return "Bán kết"
+    if left == 2: return "Tứ kết"
+    return f"Vòng 1/{2 ** left}"
+
+def knockout_qualifiers(tournament_id):
+    """
+    Danh sách đi tiếp theo thứ tự hạt giống: nhất các bảng trước, rồi nhì các bảng, ...
+    (cùng thứ hạng trong bảng thì so Điểm -> Hiệu số -> Điểm ghi). Mỗi phần tử: {id, pool, pool_rank}.
+    Giải không chia bảng lấy top adv_per_pool (hoặc tất cả) của BXH chung.
+    """
+    t = get_tournament_by_id(tournament_id)
+    adv = int(t["adv_per_pool"] or 0)
+    if t["use_pools"]:
+        rows = [
+            (rank, s, pool)
+            for pool, lst in compute_pool_standings(tournament_id).items()
+            for rank, s in enumerate(lst[:adv or 1], start=1)
+        ]
+    else:
+        std = compute_standings(tournament_id)
+        rows = [(1, s, None) for s in (std[:adv] if adv else std)]
+    rows.sort(key=lambda r: (r[0], -r[1]["points"], -r[1]["diff"], -r[1]["pts_for"]))
+    return [{"id": s["id"], "pool": pool, "pool_rank": rank} for rank, s, pool in rows]
+
+def _seed_first_round(qualifiers):
+    """
+    Xếp hạt giống vào vòng 1: [(seed_a, seed_b), ...]; seed > len(qualifiers) là bye.
+    Nhất bảng rơi vào các nhánh khác nhau; hạn chế 2 đội cùng bảng gặp nhau ngay vòng 1
+    bằng cách đổi chỗ với đội cùng thứ hạng bảng ở cặp khác.
+    """
+    n = len(qualifiers)
+    size = 1
+    while size < n:
+        size *= 2
+    order = bracket_seed_order(size)
+    pairs = [[order[i], order[i + 1]] for i in range(0, size, 2)]
+    info = lambda seed: qualifiers[seed - 1] if seed <= n else None
+
+    def clash(a, b):
+        qa, qb = info(a), info(b)
+        return qa is not None and qb is not None and qa["pool"] is not None and qa["pool"] == qb["pool"]
+
+    for p in pairs:
+        if not clash(*p):
+            continue
+        lo = max(p)  # đội hạt giống thấp hơn được đổi chỗ
+        for q in pairs:
+            if q is p:
+                continue
+            for j, other in enumerate(q):
+                if info(other) is None or info(other)["pool_rank"] != info(lo)["pool_rank"]:
+                    continue
+                mate = q[1 - j]
+                if not clash(min(p), other) and not clash(mate, lo):
+                    p[p.index(lo)], q[j] = other, lo
+                    break
+            else:
+                continue
+            break
+    return [tuple(p) for p in pairs]
+
+def _open_bracket_match(cur, node):
+    """Tạo trận (chưa có tỉ số) cho nút nhánh đấu đã đủ 2 đội; trả về {id, competitor1_id, competitor2_id, stage}."""
+    cur.execute(
+        "INSERT INTO matches (tournament_id, competitor1_id, competitor2_id, round_no, stage) VALUES (?, ?, ?, ?, 'knockout')",
+        (node["tournament_id"], node["competitor1_id"], node["competitor2_id"], node["round_no"]),
+    )
+    match_id = cur.lastrowid
+    cur.execute("UPDATE bracket_nodes SET match_id = ? WHERE id = ?", (match_id, node["id"]))
+    return {"id": match_id, "competitor1_id": node["competitor1_id"], "competitor2_id": node["competitor2_id"], "stage": "knockout"}
+
+def _next_bracket_node(cur, node):
+    cur.execute(
+        "SELECT * FROM bracket_nodes WHERE tournament_id = ? AND round_no = ? AND slot = ?",
+        (node["tournament_id"], node["round_no"] + 1, node["slot"] // 2),
+    )
+    return cur.fetchone()
+
+def _advance_bracket(cur, m):
+    """
+    Đưa đội thắng của trận loại trực tiếp `m` vào nút kế tiếp (O(1), trong giao dịch của caller).
+    Trả về trận vòng sau nếu vừa được mở, ngược lại None.
+    """
+    if m["stage"] != "knockout" or m["confirmed_by"] is None:
+        return None
+    cur.execute("SELECT * FROM bracket_nodes WHERE match_id = ?", (m["id"],))
+    node = cur.fetchone()
+    if node is None:
+        return None
+    winner = m["winner_id"]
+    cur.execute("UPDATE bracket_nodes SET winner_id = ? WHERE id = ?", (winner, node["id"]))
+    seed = node["seed1"] if winner == node["competitor1_id"] else node["seed2"]
+    side = node["slot"] % 2 + 1
+    cur.execute(
+        f"UPDATE bracket_nodes SET competitor{side}_id = ?, seed{side} = ? "
+        "WHERE tournament_id = ? AND round_no = ? AND slot = ?",
+        (winner, seed, node["tournament_id"], node["round_no"] + 1, node["slot"] // 2),
+    )
+    nxt = _next_bracket_node(cur, node)
+    if nxt is not None and nxt["competitor1_id"] and nxt["competitor2_id"] and nxt["match_id"] is None:
+        return _open_bracket_match(cur, nxt)
+    return None
+
+def _retract_bracket(cur, m):
+    """
+    Huỷ việc đi tiếp của trận loại trực tiếp `m` (khi xoá kết quả).
+    Trả về False nếu trận vòng sau đã có kết quả (phải xoá trận đó trước).
+    """
+    cur.execute("SELECT * FROM bracket_nodes WHERE match_id = ?", (m["id"],))
+    node = cur.fetchone()
+    if node is None or node["winner_id"] is None:
+        return True
+    nxt = _next_bracket_node(cur, node)
+    if nxt is not None:
+        if nxt["match_id"] is not None:
+            cur.execute("SELECT score1 FROM matches WHERE id = ?", (nxt["match_id"],))
+            row = cur.fetchone()
+            if row is not None and row["score1"] is not None:
+                return False
+            cur.execute("DELETE FROM matches WHERE id = ?", (nxt["match_id"],))
+        side = node["slot"] % 2 + 1
+        cur.execute(
+            f"UPDATE bracket_nodes SET competitor{side}_id = NULL, seed{side} = NULL, match_id = NULL WHERE id = ?",
+            (nxt["id"],),
+        )
+    cur.execute("UPDATE bracket_nodes SET winner_id = NULL WHERE id = ?", (node["id"],))
+    return True
+
+def generate_knockout(tournament_id):
+    """
+    Tạo nhánh đấu loại trực tiếp từ danh sách đi tiếp (knockout_qualifiers).
+    Đội được bye đi thẳng vào vòng sau. Nhánh đấu cũ bị thay thế nếu chưa có trận nào có kết quả.
+    Trả về số đội vào nhánh đấu, hoặc None nếu đã có kết quả vòng loại trực tiếp.
+    """
+    qualifiers = knockout_qualifiers(tournament_id)
+    if len(qualifiers) < 2:
+        return 0
+    n = len(qualifiers)
+    first_round = _seed_first_round(qualifiers)
+    total_rounds = len(first_round).bit_length()
+
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute(
+        "SELECT COUNT(*) FROM matches WHERE tournament_id = ? AND stage = 'knockout' AND score1 IS NOT NULL",
+        (tournament_id,),
+    )
+    if cur.fetchone()[0]:
+        conn.rollback(); conn.close()
+        return None
+    cur.execute("DELETE FROM matches WHERE tournament_id = ? AND stage = 'knockout'", (tournament_id,))
+    cur.execute("DELETE FROM bracket_nodes WHERE tournament_id = ?", (tournament_id,))
+
+    nodes = {
+        (r, slot): {"c1": None, "c2": None, "s1": None, "s2": None, "winner": None}
+        for r in range(1, total_rounds + 1)
+        for slot in range(len(first_round) >> (r - 1))
+    }
+    for slot, (a, b) in enumerate(first_round):
+        node = nodes[(1, slot)]
+        for side, seed in ((1, a), (2, b)):
+            if seed <= n:
+                node[f"c{side}"] = qualifiers[seed - 1]["id"]; node[f"s{side}"] = seed
+        if node["c1"] is None or node["c2"] is None:
+            # Bye -> đội còn lại đi tiếp luôn
+            node["winner"] = node["c1"] or node["c2"]
+            nxt = nodes[(2, slot // 2)]
+            side = slot % 2 + 1
+            nxt[f"c{side}"] = node["winner"]; nxt[f"s{side}"] = node["s1"] or node["s2"]
+    cur.executemany(
+        "INSERT INTO bracket_nodes (tournament_id, round_no, slot, competitor1_id, competitor2_id, seed1, seed2, winner_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (tournament_id, r, slot, nd["c1"], nd["c2"], nd["s1"], nd["s2"], nd["winner"])
+            for (r, slot), nd in sorted(nodes.items())
+        ],
+    )
+    cur.execute(
+        "SELECT * FROM bracket_nodes WHERE tournament_id = ? AND winner_id IS NULL "
+        "AND competitor1_id IS NOT NULL AND competitor2_id IS NOT NULL",
+        (tournament_id,),
+    )
+    for node in cur.fetchall():
+        _open_bracket_match(cur, node)
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(tournament_id))
+    return n
+
+def clear_knockout(tournament_id):
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM matches WHERE tournament_id = ? AND stage = 'knockout'", (tournament_id,))
+    cur.execute("DELETE FROM bracket_nodes WHERE tournament_id = ?", (tournament_id,))
+    conn.commit()
+    conn.close()
+    invalidate(tournament_scope(tournament_id))
+
+SQL_BRACKET_NODES = """
+    SELECT b.*, m.score1, m.score2
+    FROM bracket_nodes b
+    LEFT JOIN matches m ON m.id = b.match_id
+    WHERE b.tournament_id = ?
+    ORDER BY b.round_no, b.slot
+"""
+
+@cached_derived(lambda tournament_id: [tournament_scope(tournament_id)])
+def get_bracket(tournament_id):
+    """Các nút nhánh đấu theo vòng: [[node, ...], ...] (vòng 1 trước)."""
+    conn = get_conn()
+    cur = conn.cursor()
+    cur.execute(SQL_BRACKET_NODES, (tournament_id,))
+    rounds = []
+    for r in cur.fetchall():
+        if len(rounds) < r["round_no"]:
+            rounds.append([])
+        rounds[-1].append(dict(r))
+    conn.close()
+    return rounds
+
+# ------------------ Query-plan check ------------------ #
+
+# Truy vấn nóng của các helper ở trên + tham số mẫu để chạy EXPLAIN QUERY PLAN
+HOT_QUERIES = {
+    "get_user_by_session_token": (SQL_SESSION_USER, ("token",)),
+    "compute_hnpr": (SQL_HNPR, ()),
+    "get_tournament_players": (SQL_TOURNAMENT_PLAYERS_APPROVED, (1,)),
+    "get_competitors": (SQL_COMPETITORS_BY_TOURNAMENT, (1,)),
+    "get_competitor_members_map": (SQL_COMPETITOR_MEMBERS, (1,)),
+    "get_matches": (SQL_MATCHES_BY_TOURNAMENT, (1,)),
+    "compute_standings": (SQL_STANDINGS, (1,)),
+    "compute_pool_standings": (SQL_POOL_STANDINGS, (1,)),
+    "rebuild_standings": (SQL_STANDINGS_FROM_MATCHES, {"t": 1}),
+    "count_cross_pool_matches": (SQL_CROSS_POOL_MATCH_COUNT, (1,)),
+    "get_bracket": (SQL_BRACKET_NODES, (1,)),
+    "get_partner_history": (SQL_PARTNER_HISTORY, (1, 1)),
+    "get_personal_ranking": (SQL_PERSONAL_RANKING, (1,)),
+    "get_btc_ranking": (SQL_BTC_RANKING, ()),
+}
+
+def explain_query_plan(conn, sql, params=()):
+    return [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+
+def find_full_scans(conn=None):
+    """
+    Chạy EXPLAIN QUERY PLAN cho mọi truy vấn trong HOT_QUERIES.
+    Trả về {tên truy vấn: [các bước SCAN toàn bảng]}; rỗng nghĩa là mọi truy vấn đều dùng index.
+    (Quét bằng index hoặc quét subquery/CTE không bị tính là quét toàn bảng.)
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_conn()
+    try:
+        problems = {}
+        for name, (sql, params) in HOT_QUERIES.items():
+            scans = [
+                d for d in explain_query_plan(conn, sql, params)
+                if d.startswith("SCAN ") and not d.startswith("SCAN (")
+                and "INDEX" not in d and "CONSTANT ROW" not in d
+            ]
+            if scans:
+                problems[name] = scans
+        return problems
+    finally:
+        if own_conn:
+            conn.close()
+
 # ------------------ UI sections ------------------ #
 
 def ui_login_register():
@@ -1102,6 +2951,52 @@ def ui_login_register():
                     finally:
                         conn.close()
 
+def ui_system_stats():
+    with st.expander("⚙️ Thông số hệ thống", expanded=False):
+        st.markdown("**Pool kết nối CSDL**")
+        st.json(get_pool(DB_PATH).stats())
+
+        st.markdown("**Kiểm tra query plan (truy vấn nóng)**")
+        scans = find_full_scans()
+        if scans:
+            st.error("Có truy vấn nóng đang quét toàn bảng:")
+            st.json(scans)
+        else:
+            st.success(f"Cả {len(HOT_QUERIES)} truy vấn nóng đều dùng index.")
+
+        st.markdown("**Cache dữ liệu dẫn xuất (dùng chung giữa các session)**")
+        st.json(get_derived_cache().stats())
+
+        st.markdown("**BXH HNPR lưu sẵn (hnpr_scores)**")
+        c_check, c_rebuild = st.columns(2)
+        if c_check.button("🔍 Đối chiếu HNPR", key="hnpr_check"):
+            diffs = check_hnpr_scores()
+            if diffs:
+                st.error(f"Có {len(diffs)} VĐV bị lệch so với tính lại từ đầu.")
+                st.json(diffs[:50])
+            else:
+                st.success("hnpr_scores khớp với toàn bộ phiếu cá nhân.")
+        if c_rebuild.button("🔄 Dựng lại HNPR", key="hnpr_rebuild"):
+            rebuild_hnpr_scores()
+            st.success("Đã dựng lại hnpr_scores.")
+
+        st.markdown("**BXH giải lưu sẵn (standings)**")
+        c_check, c_rebuild = st.columns(2)
+        if c_check.button("🔍 Đối chiếu BXH các giải", key="standings_check"):
+            bad = {}
+            for t in get_tournaments():
+                diffs = verify_standings(t["id"])
+                if diffs:
+                    bad[t["name"]] = diffs[:20]
+            if bad:
+                st.error("Có giải bị lệch BXH so với tính lại từ đầu.")
+                st.json(bad)
+            else:
+                st.success("standings khớp với toàn bộ trận đấu.")
+        if c_rebuild.button("🔄 Dựng lại BXH các giải", key="standings_rebuild"):
+            rebuild_standings()
+            st.success("Đã dựng lại standings.")
+
 def ui_member_management():
     require_role(["is_admin", "is_btc"])
     st.subheader("👥 Quản lý thành viên")
@@ -1182,6 +3077,10 @@ def ui_member_management():
                         conn.close()
 
 
+    # Thông số hệ thống (chỉ admin)
+    if st.session_state["user"].get("is_admin"):
+        ui_system_stats()
+
     # =========================
     # 2. DANH SÁCH THÀNH VIÊN & PHÂN QUYỀN
     # =========================
@@ -1306,17 +3205,113 @@ def ui_member_management():
 
     conn.close()
 
+def _move_in_order(state_key, idx, offset):
+    # Callback của nút ▲/▼: sửa thứ tự trước khi fragment vẽ lại -> chỉ 1 lần chạy lại / click
+    order = st.session_state[state_key]
+    new_idx = max(0, min(len(order) - 1, idx + offset))
+    if new_idx != idx:
+        order.insert(new_idx, order.pop(idx))
+
+def _move_to_position(state_key, sel_key, pos_key):
+    # Callback "Chuyển": đưa các VĐV đã chọn (theo thứ tự chọn) tới hạng đích, rồi bỏ chọn
+    order = st.session_state[state_key]
+    picked = list(st.session_state.get(sel_key) or [])
+    if not picked:
+        return
+    picked_set = set(picked)
+    rest = [uid for uid in order if uid not in picked_set]
+    at = max(0, min(len(rest), int(st.session_state[pos_key]) - 1))
+    order[:] = rest[:at] + picked + rest[at:]
+    st.session_state[sel_key] = []
+
+# Danh sách dài hơn mức này mặc định ẩn nút ▲/▼ từng dòng (chỉ hiện bảng)
+RANKING_ROW_BUTTONS_MAX = 50
+
+@st.fragment
+def ui_ranking_order_list(state_key, names_key, key_prefix):
+    """
+    Danh sách xếp hạng đang sửa (dùng chung cho BXH BTC và BXH cá nhân).
+    Là fragment: mọi thao tác chỉ chạy lại phần này, đọc thứ tự + tên từ session_state, không truy vấn DB.
+    - Chuyển nhanh: chọn nhiều VĐV + nhập hạng đích -> 1 lần bấm
+    - Nút ⏫ / ▲ / ▼ / ⏬ từng dòng để chỉnh tinh
+    Thứ tự chỉ ghi vào DB khi bấm Lưu ở trang sửa.
+    """
+    order = st.session_state[state_key]
+    id_to_name = st.session_state[names_key]
+
+    st.markdown("#### Chuyển nhanh tới hạng")
+    rank_of = {uid: idx + 1 for idx, uid in enumerate(order)}
+    sel_key = f"{key_prefix}_move_sel"
+    pos_key = f"{key_prefix}_move_to"
+    c_sel, c_pos, c_go = st.columns([0.6, 0.2, 0.2])
+    with c_sel:
+        st.multiselect(
+            "VĐV cần chuyển (giữ thứ tự chọn)",
+            options=order,
+            format_func=lambda uid: f"{rank_of[uid]}. {id_to_name.get(uid, f'ID {uid}')}",
+            key=sel_key,
+        )
+    with c_pos:
+        st.number_input("Tới hạng", min_value=1, max_value=max(1, len(order)), value=1, step=1, key=pos_key)
+    with c_go:
+        st.button(
+            "↪ Chuyển",
+            key=f"{key_prefix}_move_go",
+            use_container_width=True,
+            on_click=_move_to_position,
+            args=(state_key, sel_key, pos_key),
+        )
+
+    st.markdown("#### Danh sách xếp hạng hiện tại")
+
+    show_buttons = st.checkbox(
+        "Hiện nút di chuyển từng dòng",
+        value=len(order) <= RANKING_ROW_BUTTONS_MAX,
+        key=f"{key_prefix}_row_buttons",
+    )
+    if not show_buttons:
+        st.dataframe(
+            [{"Hạng": idx + 1, "VĐV": id_to_name.get(uid, f"ID {uid}")} for idx, uid in enumerate(order)],
+            hide_index=True,
+            use_container_width=True,
+        )
+        return
+
+    for idx, uid in enumerate(order):
+        name = id_to_name.get(uid, f"ID {uid}")
+        col1, col2, col3 = st.columns([0.1, 0.6, 0.3])
+
+        with col1:
+            st.markdown(f"**{idx + 1}**")
+
+        with col2:
+            st.write(name)
+
+        with col3:
+            c1, c2, c3, c4 = st.columns(4)
+            # ⏫ / ▲: lên 3 / 1 bậc; ▼ / ⏬: xuống 1 / 3 bậc
+            for col, label, offset, tag in (
+                (c1, "⏫", -3, "up3"), (c2, "▲", -1, "up1"), (c3, "▼", +1, "down1"), (c4, "⏬", +3, "down3"),
+            ):
+                col.button(
+                    label,
+                    key=f"{key_prefix}_{tag}_{uid}",
+                    on_click=_move_in_order,
+                    args=(state_key, idx, offset),
+                )
+
 def ui_btc_ranking_edit():
     """
     Trang riêng để Ban tổ chức chỉnh BXH BTC
-    - Có 4 nút: mũi tên đôi (±3 bậc), mũi tên đơn (±1 bậc)
+    - Chuyển nhanh nhiều VĐV tới 1 hạng; 4 nút: mũi tên đôi (±3 bậc), mũi tên đơn (±1 bậc)
     """
     require_role(["is_admin", "is_btc"])
 
     st.markdown("### ✏️ Chỉnh sửa BXH do Ban tổ chức")
     st.caption(
-        "Dùng các nút ở cuối mỗi dòng để di chuyển VĐV: "
-        "⏫ / ⏬ = lên/xuống 3 bậc, ▲ / ▼ = lên/xuống 1 bậc."
+        "Chọn một hoặc nhiều VĐV rồi nhập hạng đích để chuyển nhanh; "
+        "hoặc dùng các nút ở cuối mỗi dòng: ⏫ / ⏬ = lên/xuống 3 bậc, ▲ / ▼ = lên/xuống 1 bậc. "
+        "Thứ tự chỉ được ghi khi bấm Lưu."
     )
 
     # --- Nút quay lại trang BXH / khởi tạo lại ---
@@ -1327,15 +3322,14 @@ def ui_btc_ranking_edit():
             st.session_state.pop("btc_edit_order", None)
             st.rerun()
 
-    players = get_all_players(only_approved=True)
-    if not players:
-        st.info("Chưa có thành viên nào để xếp hạng.")
-        return
-
-    btc_rank = get_btc_ranking()
-    hnpr = compute_hnpr()
-
     def build_default_btc_order():
+        # Đọc DB 1 lần khi mở trang sửa (hoặc khi khởi tạo lại); các lần bấm nút sau đó
+        # chỉ chạy lại fragment danh sách, dùng thứ tự + tên trong session_state
+        players = get_all_players(only_approved=True)
+        btc_rank = get_btc_ranking()
+        hnpr = compute_hnpr()
+        st.session_state["btc_edit_names"] = {p["id"]: p["full_name"] for p in players}
+
         # Nếu đã có BXH BTC -> dùng thứ tự hiện tại
         if btc_rank:
             base_ids = [r["ranked_user_id"] for r in btc_rank]
@@ -1350,7 +3344,8 @@ def ui_btc_ranking_edit():
         others = [p for p in players if p["id"] not in base_set]
         others_sorted = sorted(others, key=lambda p: p["full_name"])
         base_ids.extend([p["id"] for p in others_sorted])
-        return base_ids
+        # Loại ID không còn tồn tại
+        return [uid for uid in base_ids if uid in st.session_state["btc_edit_names"]]
 
     with c_reset:
         if st.button(
@@ -1363,56 +3358,14 @@ def ui_btc_ranking_edit():
             st.rerun()
 
     # Khởi tạo state thứ tự
-    if "btc_edit_order" not in st.session_state:
+    if "btc_edit_order" not in st.session_state or "btc_edit_names" not in st.session_state:
         st.session_state["btc_edit_order"] = build_default_btc_order()
 
-    order = st.session_state["btc_edit_order"]
-    id_to_name = {p["id"]: p["full_name"] for p in players}
-
-    # Loại ID không còn tồn tại
-    order = [uid for uid in order if uid in id_to_name]
-    st.session_state["btc_edit_order"] = order
-
-    st.markdown("#### Danh sách xếp hạng hiện tại")
-
-    # Để tránh sửa list khi đang iterate, gom action lại
-    action = None  # (index, offset)
-
-    for idx, uid in enumerate(order):
-        name = id_to_name.get(uid, f"ID {uid}")
-        col1, col2, col3 = st.columns([0.1, 0.6, 0.3])
-
-        with col1:
-            st.markdown(f"**{idx + 1}**")
-
-        with col2:
-            st.write(name)
+    if not st.session_state["btc_edit_names"]:
+        st.info("Chưa có thành viên nào để xếp hạng.")
+        return
 
-        with col3:
-            c1, c2, c3, c4 = st.columns(4)
-            # ⏫: lên 3 bậc
-            if c1.button("⏫", key=f"btc_up3_{uid}"):
-                action = (idx, -3)
-            # ▲: lên 1 bậc
-            if c2.button("▲", key=f"btc_up1_{uid}"):
-                action = (idx, -1)
-            # ▼: xuống 1 bậc
-            if c3.button("▼", key=f"btc_down1_{uid}"):
-                action = (idx, +1)
-            # ⏬: xuống 3 bậc
-            if c4.button("⏬", key=f"btc_down3_{uid}"):
-                action = (idx, +3)
-
-    # Thực hiện di chuyển sau khi biết nút nào được bấm
-    if action is not None:
-        idx, offset = action
-        new_idx = max(0, min(len(order) - 1, idx + offset))
-        if new_idx != idx:
-            new_order = list(order)
-            item = new_order.pop(idx)
-            new_order.insert(new_idx, item)
-            st.session_state["btc_edit_order"] = new_order
-        st.rerun()
+    ui_ranking_order_list("btc_edit_order", "btc_edit_names", "btc")
 
     st.markdown("---")
     c_save, c_delete = st.columns([2, 1])
@@ -1474,6 +3427,20 @@ def ui_hnpr_page():
         height=500,
     )
 
+def tournament_view_sections(t):
+    """Các mục xem của 1 giải (tên mục -> hàm view), theo thể thức giải."""
+    ctype = t["competition_type"] if t["competition_type"] in ("pair", "team") else "pair"
+    sections = {
+        "Thành viên": ui_tournament_players_view,
+        "Phân nhóm trình": ui_tournament_groups_view,
+        "Chia cặp" if ctype == "pair" else "Chia đội": ui_tournament_pairs_teams_view,
+    }
+    if t["use_pools"]:
+        sections["Phân bảng"] = ui_tournament_pools_view
+    sections["Lịch & Kết quả"] = ui_tournament_results_view
+    sections["Xếp hạng"] = ui_tournament_standings
+    return sections
+
 def ui_home():
     user = st.session_state.get("user")
 
@@ -1483,147 +3450,128 @@ def ui_home():
         st.info("Chưa có giải đấu nào.")
         return
 
-    for t in active_ts:
-        with st.container():
-            # Thẻ giải đấu
-            st.markdown(
-                f"""
-                <div class="tournament-card">
-                    <div class="t-title">{t['name']}</div>
-                """,
-                unsafe_allow_html=True,
-            )
+    # Chỉ dựng giải + mục đang xem: st.tabs chạy mọi tab của mọi giải ở mỗi lần rerun,
+    # còn radio chỉ gọi đúng 1 hàm view -> thời gian rerun không tăng theo số giải đang chạy
+    by_id = {t["id"]: t for t in active_ts}
+    t_id = active_ts[0]["id"]
+    if len(active_ts) > 1:
+        t_id = st.radio(
+            "Chọn giải",
+            list(by_id),
+            format_func=lambda i: by_id[i]["name"],
+            horizontal=True,
+            key="home_tournament",
+        )
+    t = by_id[t_id]
 
-            # Kiểu thi đấu & phân bảng
-            ctype = (
-                t["competition_type"]
-                if "competition_type" in t.keys()
-                and t["competition_type"] in ("pair", "team")
-                else "pair"
-            )
-            use_pools = bool(t["use_pools"]) if "use_pools" in t.keys() else False
-
-            # Thông tin cơ bản
-            st.markdown(
-                f"""
-                <div class="info-grid">
-                    <div class="info-item">
-                        <span class="info-label">📍 Địa điểm</span>
-                        <span class="info-value">{t['location'] or 'N/A'}</span>
-                    </div>
-                    <div class="info-item">
-                        <span class="info-label">🗓️ Thời gian</span>
-                        <span class="info-value">{t['start_date']} - {t['end_date']}</span>
-                    </div>
-                    <div class="info-item">
-                        <span class="info-label">🎾 Thể loại</span>
-                        <span class="info-value">{'Theo cặp' if ctype == 'pair' else 'Theo đội'}</span>
-                    </div>
-                    <div class="info-item">
-                        <span class="info-label">📊 Phân bảng</span>
-                        <span class="info-value">{'Có' if use_pools else 'Không'}</span>
-                    </div>
+    with st.container():
+        # Thẻ giải đấu
+        st.markdown(
+            f"""
+            <div class="tournament-card">
+                <div class="t-title">{t['name']}</div>
+            """,
+            unsafe_allow_html=True,
+        )
+
+        # Kiểu thi đấu & phân bảng
+        ctype = (
+            t["competition_type"]
+            if "competition_type" in t.keys()
+            and t["competition_type"] in ("pair", "team")
+            else "pair"
+        )
+        use_pools = bool(t["use_pools"]) if "use_pools" in t.keys() else False
+
+        # Thông tin cơ bản
+        st.markdown(
+            f"""
+            <div class="info-grid">
+                <div class="info-item">
+                    <span class="info-label">📍 Địa điểm</span>
+                    <span class="info-value">{t['location'] or 'N/A'}</span>
                 </div>
+                <div class="info-item">
+                    <span class="info-label">🗓️ Thời gian</span>
+                    <span class="info-value">{t['start_date']} - {t['end_date']}</span>
                 </div>
-                """,
-                unsafe_allow_html=True,
-            )
+                <div class="info-item">
+                    <span class="info-label">🎾 Thể loại</span>
+                    <span class="info-value">{'Theo cặp' if ctype == 'pair' else 'Theo đội'}</span>
+                </div>
+                <div class="info-item">
+                    <span class="info-label">📊 Phân bảng</span>
+                    <span class="info-value">{'Có' if use_pools else 'Không'}</span>
+                </div>
+            </div>
+            </div>
+            """,
+            unsafe_allow_html=True,
+        )
 
-            st.write("")
+        st.write("")
 
-            # ========= ĐĂNG KÝ THAM GIA GIẢI =========
-            if user:
-                conn = get_conn()
-                cur = conn.cursor()
-                cur.execute(
-                    """
-                    SELECT status
-                    FROM tournament_players
-                    WHERE tournament_id = ? AND user_id = ?
-                    """,
-                    (t["id"], user["id"]),
-                )
-                row = cur.fetchone()
-                conn.close()
+        # ========= ĐĂNG KÝ THAM GIA GIẢI =========
+        if user:
+            conn = get_conn()
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT status
+                FROM tournament_players
+                WHERE tournament_id = ? AND user_id = ?
+                """,
+                (t["id"], user["id"]),
+            )
+            row = cur.fetchone()
+            conn.close()
 
-                if row:
-                    status = row["status"]
-                    if status == "approved":
-                        st.success("✅ Bạn đã được BTC duyệt tham gia giải này.")
-                    elif status == "pending":
-                        st.info("⏳ Bạn đã đăng ký, đang chờ BTC phê duyệt.")
-                    else:
-                        st.info(f"Trạng thái đăng ký hiện tại: {status}")
+            if row:
+                status = row["status"]
+                if status == "approved":
+                    st.success("✅ Bạn đã được BTC duyệt tham gia giải này.")
+                elif status == "pending":
+                    st.info("⏳ Bạn đã đăng ký, đang chờ BTC phê duyệt.")
                 else:
-                    if st.button(
-                        "Đăng ký tham gia",
-                        type="primary",
-                        key=f"join_tour_{t['id']}",
-                    ):
-                        conn = get_conn()
-                        cur = conn.cursor()
-                        cur.execute(
-                            """
-                            INSERT OR IGNORE INTO tournament_players
-                                (tournament_id, user_id, status)
-                            VALUES (?, ?, 'pending')
-                            """,
-                            (t["id"], user["id"]),
-                        )
-                        conn.commit()
-                        conn.close()
-                        st.success("Đã gửi đăng ký, vui lòng chờ BTC phê duyệt.")
-                        st.rerun()
+                    st.info(f"Trạng thái đăng ký hiện tại: {status}")
             else:
-                st.caption("Đăng nhập để đăng ký tham gia giải.")
-
-            st.write("")
-
-            # ========= TABS CHỨC NĂNG CỦA GIẢI =========
-            pair_team_label = "Chia cặp" if ctype == "pair" else "Chia đội"
-
-            if use_pools:
-                tabs_list = [
-                    "Thành viên",
-                    "Phân nhóm trình",
-                    pair_team_label,
-                    "Phân bảng",
-                    "Lịch & Kết quả",
-                    "Xếp hạng",
-                ]
-            else:
-                tabs_list = [
-                    "Thành viên",
-                    "Phân nhóm trình",
-                    pair_team_label,
-                    "Lịch & Kết quả",
-                    "Xếp hạng",
-                ]
-
-            tab_objs = st.tabs(tabs_list)
-
-            with tab_objs[0]:
-                ui_tournament_players_view(t["id"])
-            with tab_objs[1]:
-                ui_tournament_groups_view(t["id"])
-            with tab_objs[2]:
-                ui_tournament_pairs_teams_view(t["id"])
-
-            if use_pools:
-                with tab_objs[3]:
-                    ui_tournament_pools_view(t["id"])
-                with tab_objs[4]:
-                    ui_tournament_results_view(t["id"])
-                with tab_objs[5]:
-                    ui_tournament_standings(t["id"])
-            else:
-                with tab_objs[3]:
-                    ui_tournament_results_view(t["id"])
-                with tab_objs[4]:
-                    ui_tournament_standings(t["id"])
+                if st.button(
+                    "Đăng ký tham gia",
+                    type="primary",
+                    key=f"join_tour_{t['id']}",
+                ):
+                    conn = get_conn()
+                    cur = conn.cursor()
+                    cur.execute(
+                        """
+                        INSERT OR IGNORE INTO tournament_players
+                            (tournament_id, user_id, status)
+                        VALUES (?, ?, 'pending')
+                        """,
+                        (t["id"], user["id"]),
+                    )
+                    conn.commit()
+                    conn.close()
+                    st.success("Đã gửi đăng ký, vui lòng chờ BTC phê duyệt.")
+                    st.rerun()
+        else:
+            st.caption("Đăng nhập để đăng ký tham gia giải.")
 
         st.write("")
 
+        # ========= MỤC CỦA GIẢI (chỉ dựng mục đang xem) =========
+        sections = tournament_view_sections(t)
+        section = st.radio(
+            "Mục",
+            list(sections),
+            horizontal=True,
+            key=f"home_section_{t['id']}",
+            label_visibility="collapsed",
+        )
+        sections[section](t["id"])
+
+    st.write("")
+
 def ui_profile_page():
     require_login()
     user = st.session_state["user"]
@@ -1758,6 +3706,7 @@ def ui_profile_page():
                             ),
                         )
                         conn.commit()
+                        invalidate("users")
                         st.success("Đã cập nhật thông tin và mật khẩu.")
                         st.session_state["user"] = dict(get_user_by_id(user["id"]))
             else:
@@ -1777,6 +3726,7 @@ def ui_profile_page():
                     ),
                 )
                 conn.commit()
+                invalidate("users")
                 st.success("Đã cập nhật thông tin.")
                 st.session_state["user"] = dict(get_user_by_id(user["id"]))
 
@@ -1785,7 +3735,7 @@ def ui_profile_page():
 def ui_personal_ranking_edit(owner_id: int):
     """
     Trang riêng chỉnh sửa BXH cá nhân của 1 người chơi
-    - Dùng mũi tên đôi (±3) và mũi tên đơn (±1) giống trang BTC
+    - Chuyển nhanh tới hạng, mũi tên đôi (±3) và mũi tên đơn (±1) giống trang BTC
     """
     require_login()
     user = st.session_state["user"]
@@ -1797,8 +3747,9 @@ def ui_personal_ranking_edit(owner_id: int):
 
     st.markdown("### ✏️ Chỉnh sửa BXH cá nhân")
     st.caption(
-        "Dùng các nút ở cuối mỗi dòng để di chuyển VĐV: "
-        "⏫ / ⏬ = lên/xuống 3 bậc, ▲ / ▼ = lên/xuống 1 bậc."
+        "Chọn một hoặc nhiều VĐV rồi nhập hạng đích để chuyển nhanh; "
+        "hoặc dùng các nút ở cuối mỗi dòng: ⏫ / ⏬ = lên/xuống 3 bậc, ▲ / ▼ = lên/xuống 1 bậc. "
+        "Thứ tự chỉ được ghi khi bấm Lưu."
     )
 
     # Nút quay lại Trang cá nhân + khởi tạo lại
@@ -1813,15 +3764,16 @@ def ui_personal_ranking_edit(owner_id: int):
             st.session_state.pop(f"personal_edit_order_{owner_id}", None)
             st.rerun()
 
-    players = [p for p in get_all_players(only_approved=True) if p["id"] != owner_id]
-    if not players:
-        st.info("Chưa có đủ thành viên khác để xếp hạng.")
-        return
-
-    existing = get_personal_ranking(owner_id)
-    hnpr = compute_hnpr()
+    state_key = f"personal_edit_order_{owner_id}"
+    names_key = f"personal_edit_names_{owner_id}"
 
     def build_default_personal_order():
+        # Đọc DB 1 lần khi mở trang sửa (hoặc khi khởi tạo lại), như trang BTC
+        players = [p for p in get_all_players(only_approved=True) if p["id"] != owner_id]
+        existing = get_personal_ranking(owner_id)
+        hnpr = compute_hnpr()
+        st.session_state[names_key] = {p["id"]: p["full_name"] for p in players}
+
         if existing:
             base_ids = [r["ranked_user_id"] for r in existing]
         else:
@@ -1833,7 +3785,8 @@ def ui_personal_ranking_edit(owner_id: int):
         others = [p for p in players if p["id"] not in base_set]
         others_sorted = sorted(others, key=lambda p: p["full_name"])
         base_ids.extend([p["id"] for p in others_sorted])
-        return base_ids
+        # Loại id không còn trong danh sách
+        return [uid for uid in base_ids if uid in st.session_state[names_key]]
 
     # Khởi tạo lại theo HNPR/ABC
     with c_reset:
@@ -1848,55 +3801,14 @@ def ui_personal_ranking_edit(owner_id: int):
             st.success("Đã khởi tạo lại BXH cá nhân theo HNPR/ABC.")
             st.rerun()
 
-    state_key = f"personal_edit_order_{owner_id}"
-    if state_key not in st.session_state:
+    if state_key not in st.session_state or names_key not in st.session_state:
         st.session_state[state_key] = build_default_personal_order()
 
-    order = st.session_state[state_key]
-    id_to_name = {p["id"]: p["full_name"] for p in players}
-
-    # Loại id không còn trong danh sách
-    order = [uid for uid in order if uid in id_to_name]
-    st.session_state[state_key] = order
-
-    st.markdown("#### Danh sách xếp hạng hiện tại")
-
-    action = None  # (index, offset)
-
-    for idx, uid in enumerate(order):
-        name = id_to_name.get(uid, f"ID {uid}")
-        col1, col2, col3 = st.columns([0.1, 0.6, 0.3])
-
-        with col1:
-            st.markdown(f"**{idx + 1}**")
-
-        with col2:
-            st.write(name)
+    if not st.session_state[names_key]:
+        st.info("Chưa có đủ thành viên khác để xếp hạng.")
+        return
 
-        with col3:
-            c1, c2, c3, c4 = st.columns(4)
-            # ⏫: lên 3 bậc
-            if c1.button("⏫", key=f"personal_up3_{owner_id}_{uid}"):
-                action = (idx, -3)
-            # ▲: lên 1 bậc
-            if c2.button("▲", key=f"personal_up1_{owner_id}_{uid}"):
-                action = (idx, -1)
-            # ▼: xuống 1 bậc
-            if c3.button("▼", key=f"personal_down1_{owner_id}_{uid}"):
-                action = (idx, +1)
-            # ⏬: xuống 3 bậc
-            if c4.button("⏬", key=f"personal_down3_{owner_id}_{uid}"):
-                action = (idx, +3)
-
-    if action is not None:
-        idx, offset = action
-        new_idx = max(0, min(len(order) - 1, idx + offset))
-        if new_idx != idx:
-            new_order = list(order)
-            item = new_order.pop(idx)
-            new_order.insert(new_idx, item)
-            st.session_state[state_key] = new_order
-        st.rerun()
+    ui_ranking_order_list(state_key, names_key, f"personal_{owner_id}")
 
     st.markdown("---")
     c_save, c_delete = st.columns([2, 1])
@@ -2025,6 +3937,8 @@ def ui_tournament_list_page():
                     d_adv = t["adv_per_pool"]
                 else:
                     d_adv = None
+
+                d_sys = t["pairing_system"] or "round_robin"
             else:
                 # fallback nếu không tìm thấy giải (hiếm)
                 d_name = ""
@@ -2036,6 +3950,7 @@ def ui_tournament_list_page():
                 d_ctype = "pair"
                 d_pool = True
                 d_adv = None
+                d_sys = "round_robin"
         else:
             d_name = ""
             d_start = ""
@@ -2046,6 +3961,7 @@ def ui_tournament_list_page():
             d_ctype = "pair"
             d_pool = True
             d_adv = None
+            d_sys = "round_robin"
 
         with st.form("tournament_form"):
             col1, col2 = st.columns(2)
@@ -2053,6 +3969,13 @@ def ui_tournament_list_page():
                 name = st.text_input("Tên giải", value=d_name)
                 location = st.text_input("Địa điểm", value=d_loc)
                 num_courts = st.number_input("Số sân", 1, 20, d_nc)
+                pairing = st.radio(
+                    "Xếp lịch",
+                    ["Vòng tròn", "Swiss"],
+                    index=1 if d_sys == "swiss" else 0,
+                    horizontal=True,
+                    help="Swiss: mỗi lượt ghép các đội cùng điểm, không tái đấu – hợp với giải đông đội.",
+                )
             with col2:
                 c_d1, c_d2 = st.columns(2)
                 start_date = c_d1.text_input("Ngày bắt đầu", value=d_start or "")
@@ -2084,6 +4007,7 @@ def ui_tournament_list_page():
                         "pair" if ctype == "Theo cặp" else "team",
                         use_pools,
                         d_adv,
+                        "swiss" if pairing == "Swiss" else "round_robin",
                     )
                     st.success("Đã lưu.")
                     st.session_state["editing_tournament_id"] = None
@@ -2119,10 +4043,10 @@ def ui_tournament_detail_page(t_id: int):
     if use_pools:
         with tabs[3]: ui_tournament_pools(t_id)
         with tabs[4]: ui_tournament_results(t_id)
-        with tabs[5]: ui_tournament_standings(t_id)
+        with tabs[5]: ui_tournament_standings(t_id); ui_tournament_knockout(t_id)
     else:
         with tabs[3]: ui_tournament_results(t_id)
-        with tabs[4]: ui_tournament_standings(t_id)
+        with tabs[4]: ui_tournament_standings(t_id); ui_tournament_knockout(t_id)
 
 def ui_tournament_players_view(t_id):
     current = get_tournament_players(t_id)  # chỉ lấy approved
@@ -2248,6 +4172,7 @@ def ui_tournament_players(t_id):
                 )
                 conn.commit()
                 conn.close()
+                invalidate(tournament_scope(t_id))
                 st.success(f"Đã duyệt: {full_name}")
                 st.rerun()
         with c3:
@@ -2264,6 +4189,7 @@ def ui_tournament_players(t_id):
                 )
                 conn.commit()
                 conn.close()
+                invalidate(tournament_scope(t_id))
                 st.warning(f"Đã từ chối: {full_name}")
                 st.rerun()
 
@@ -2413,6 +4339,7 @@ def ui_tournament_groups(t_id):
                     )
                 conn.commit()
                 conn.close()
+                invalidate(tournament_scope(t_id))
                 st.success("Đã phân nhóm trình tự động theo HNPR/ABC.")
                 st.rerun()
 
@@ -2545,6 +4472,7 @@ def ui_tournament_groups(t_id):
                                 )
                             conn.commit()
                             conn.close()
+                            invalidate(tournament_scope(t_id))
                             st.success("Đã cập nhật phân nhóm trình bằng tay.")
                             st.rerun()
 
@@ -2558,16 +4486,103 @@ def ui_tournament_groups(t_id):
             )
             conn.commit()
             conn.close()
+            invalidate(tournament_scope(t_id))
             st.success("Đã xoá toàn bộ phân nhóm trình.")
             st.rerun()
 
-def make_pairs_for_tournament(t_id):
+def solve_assignment(cost):
+    """
+    Bài toán phân công (Hungarian, O(n²·m)): ma trận chi phí n × m với n <= m.
+    Trả về [cột được giao cho hàng i] với tổng chi phí nhỏ nhất.
+    """
+    n = len(cost)
+    if n == 0:
+        return []
+    m = len(cost[0])
+    INF = float("inf")
+    u = [0.0] * (n + 1); v = [0.0] * (m + 1)
+    p = [0] * (m + 1); way = [0] * (m + 1)
+    for i in range(1, n + 1):
+        p[0] = i; j0 = 0
+        minv = [INF] * (m + 1); used = [False] * (m + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]; row = cost[i0 - 1]; ui0 = u[i0]
+            delta = INF; j1 = 0
+            for j in range(1, m + 1):
+                if not used[j]:
+                    cur = row[j - 1] - ui0 - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur; way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]; j1 = j
+            for j in range(m + 1):
+                if used[j]:
+                    u[p[j]] += delta; v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while True:
+            j1 = way[j0]; p[j0] = p[j1]; j0 = j1
+            if j0 == 0:
+                break
+    ans = [-1] * n
+    for j in range(1, m + 1):
+        if p[j]:
+            ans[p[j] - 1] = j - 1
+    return ans
+
+def get_player_strengths(user_ids, source="hnpr"):
+    """
+    Sức mạnh theo thứ hạng (1 = mạnh nhất) từ HNPR hoặc BXH BTC: {user_id: hạng}.
+    Người chưa có hạng coi như yếu nhất (hạng cuối + 1).
+    """
+    if source == "btc":
+        ranks = {r["ranked_user_id"]: r["position"] for r in get_btc_ranking()}
+    else:
+        ranks = {r["user_id"]: r["rank"] for r in compute_hnpr()}
+    unranked = max(ranks.values(), default=0) + 1
+    return {uid: ranks.get(uid, unranked) for uid in user_ids}
+
+def partner_penalty(history, scale):
+    """Phạt cặp từng đánh cùng nhau: scale × số lần / (1 + số giải đã qua) – càng gần đây phạt càng nặng."""
+    def penalty(a, b):
+        h = history.get(frozenset((a, b)))
+        return scale * h[0] / (1 + h[1]) if h else 0.0
+    return penalty
+
+def balanced_pairs(left, right, strength, target, penalty=None):
+    """
+    Ghép left × right sao cho tổng sức mạnh mỗi cặp sát `target` nhất
+    (cực tiểu tổng bình phương độ lệch = phương sai sức mạnh cặp) bằng bài toán phân công.
+    penalty(a, b) (tuỳ chọn) cộng thêm chi phí cho từng cặp.
+    Trả về (pairs [(a, b)], người dư ra).
+    """
+    if len(left) > len(right):
+        pairs, rest = balanced_pairs(right, left, strength, target, penalty)
+        return [(a, b) for b, a in pairs], rest
+    cost = [
+        [(strength[a] + strength[b] - target) ** 2 + (penalty(a, b) if penalty else 0) for b in right]
+        for a in left
+    ]
+    cols = solve_assignment(cost)
+    taken = set(cols)
+    return [(a, right[j]) for a, j in zip(left, cols)], [b for j, b in enumerate(right) if j not in taken]
+
+def make_pairs_for_tournament(t_id, mode="random", strength_source="hnpr", randomness=0.3, history_weight=1.0):
     """
     Ghép cặp dựa trên phân nhóm trình:
     - Nhặt ngẫu nhiên 2 thành viên ở 2 nhóm đối xứng (A–D, B–C, ...)
     - Nếu số nhóm lẻ: nhóm giữa ghép nội bộ ngẫu nhiên.
     - Cảnh báo nếu còn VĐV không được ghép (do lệch số lượng).
     - Nếu không có group nào: fallback ghép theo HNPR (top/bottom) + cảnh báo nếu lẻ.
+    mode="balanced": vẫn giữ ràng buộc nhóm đối xứng nhưng thay việc bốc ngẫu nhiên bằng
+    balanced_pairs trên hạng HNPR / BTC (strength_source) cộng nhiễu tỉ lệ với randomness (0..1),
+    để sức mạnh các cặp đều nhau mà lần bốc thăm vẫn không cố định.
+    history_weight > 0: phạt các cặp từng đánh cùng nhau ở giải trước (get_partner_history, tải 1 lần).
+    Trả về {"spread": độ lệch chuẩn tổng hạng các cặp, "repeats": số cặp lặp lại} (None nếu không ghép được).
     """
     players = get_tournament_players(t_id)
     if len(players) < 2:
@@ -2589,6 +4604,34 @@ def make_pairs_for_tournament(t_id):
     random.seed()
 
     unpaired = []  # danh sách VĐV không được ghép
+    made = []      # các cặp đã tạo (user_id, user_id)
+
+    strength = get_player_strengths([p["user_id"] for p in players], strength_source)
+    # randomness = 1 cho độ lệch cặp xấp xỉ bốc ngẫu nhiên, 0 là tối ưu tuyệt đối
+    sd = statistics.pstdev(strength.values()) / 4
+    noisy = {uid: s + random.gauss(0, randomness * sd) for uid, s in strength.items()}
+    target = 2 * statistics.fmean(noisy.values())
+    history = get_partner_history(t_id)
+    # 1 lần lặp cặp ở giải gần nhất ~ lệch √history_weight × độ lệch chuẩn hạng về sức mạnh
+    penalty = partner_penalty(history, history_weight * (4 * sd) ** 2 or history_weight) if history and history_weight > 0 else None
+
+    def pair_up(left_players, right_players):
+        """Ghép 2 danh sách VĐV; trả về (cặp user_id, VĐV dư ra)."""
+        by_id = {p["user_id"]: p for p in left_players + right_players}
+        if mode == "balanced" or penalty:
+            # Bốc ngẫu nhiên có lịch sử: sức mạnh ngẫu nhiên, chỉ còn phần phạt cặp cũ là có ý nghĩa
+            weights = noisy if mode == "balanced" else {uid: random.random() for uid in by_id}
+            pairs, rest = balanced_pairs(
+                [p["user_id"] for p in left_players], [p["user_id"] for p in right_players],
+                weights, target if mode == "balanced" else 1.0, penalty,
+            )
+            return pairs, [by_id[uid] for uid in rest]
+        left_players = left_players[:]; right_players = right_players[:]
+        random.shuffle(left_players)
+        random.shuffle(right_players)
+        max_pairs = min(len(left_players), len(right_players))
+        pairs = [(left_players[i]["user_id"], right_players[i]["user_id"]) for i in range(max_pairs)]
+        return pairs, left_players[max_pairs:] + right_players[max_pairs:]
 
     if len(named_groups) >= 1:
         # ===== Trường hợp có phân nhóm trình =====
@@ -2601,27 +4644,10 @@ def make_pairs_for_tournament(t_id):
             gl = named_groups[left]
             gr = named_groups[right]
 
-            left_players = group_map.get(gl, [])[:]
-            right_players = group_map.get(gr, [])[:]
-
-            random.shuffle(left_players)
-            random.shuffle(right_players)
-
-            max_pairs = min(len(left_players), len(right_players))
-
-            # Ghép cặp từ 2 nhóm đối xứng
-            for i in range(max_pairs):
-                create_competitor(
-                    conn,
-                    t_id,
-                    [left_players[i]["user_id"], right_players[i]["user_id"]],
-                )
-
-            # Người dư ra (nếu có) → chưa ghép
-            for p in left_players[max_pairs:]:
-                unpaired.append(p)
-            for p in right_players[max_pairs:]:
-                unpaired.append(p)
+            # Ghép cặp từ 2 nhóm đối xứng; người dư ra (nếu có) → chưa ghép
+            pairs, rest = pair_up(group_map.get(gl, []), group_map.get(gr, []))
+            made += pairs
+            unpaired += rest
 
             left += 1
             right -= 1
@@ -2632,19 +4658,26 @@ def make_pairs_for_tournament(t_id):
             gm = named_groups[mid_idx]
 
             middle_players = group_map.get(gm, [])[:]
-            random.shuffle(middle_players)
-
-            # Ghép nội bộ trong nhóm giữa: (1-2), (3-4), ...
-            for i in range(0, len(middle_players) - 1, 2):
-                create_competitor(
-                    conn,
-                    t_id,
-                    [middle_players[i]["user_id"], middle_players[i + 1]["user_id"]],
-                )
+            if mode == "balanced" or penalty:
+                # Nửa mạnh của nhóm giữa ghép với nửa yếu (bốc ngẫu nhiên: 2 nửa ngẫu nhiên)
+                if mode == "balanced":
+                    middle_players.sort(key=lambda p: noisy[p["user_id"]])
+                else:
+                    random.shuffle(middle_players)
+                half = len(middle_players) // 2
+                pairs, rest = pair_up(middle_players[:half], middle_players[half:])
+                made += pairs
+                unpaired += rest
+            else:
+                random.shuffle(middle_players)
 
-            # Nếu lẻ 1 người → không được ghép
-            if len(middle_players) % 2 == 1:
-                unpaired.append(middle_players[-1])
+                # Ghép nội bộ trong nhóm giữa: (1-2), (3-4), ...
+                for i in range(0, len(middle_players) - 1, 2):
+                    made.append((middle_players[i]["user_id"], middle_players[i + 1]["user_id"]))
+
+                # Nếu lẻ 1 người → không được ghép
+                if len(middle_players) % 2 == 1:
+                    unpaired.append(middle_players[-1])
 
     else:
         # ===== Trường hợp không có group: fallback HNPR như cũ =====
@@ -2656,29 +4689,17 @@ def make_pairs_for_tournament(t_id):
 
         n = len(p_sorted)
         half = n // 2
-        top = p_sorted[:half]
-        bot = p_sorted[half:]
-
-        random.shuffle(top)
-        random.shuffle(bot)
-
-        max_pairs = min(len(top), len(bot))
-
-        for i in range(max_pairs):
-            create_competitor(
-                conn,
-                t_id,
-                [top[i]["user_id"], bot[i]["user_id"]],
-            )
 
         # Người dư ra (nếu số VĐV lẻ) → cảnh báo
-        for p in top[max_pairs:]:
-            unpaired.append(p)
-        for p in bot[max_pairs:]:
-            unpaired.append(p)
+        pairs, rest = pair_up(p_sorted[:half], p_sorted[half:])
+        made += pairs
+        unpaired += rest
 
+    for a, b in made:
+        create_competitor(conn, t_id, [a, b])
     conn.commit()
     conn.close()
+    invalidate(tournament_scope(t_id))
 
     # Cảnh báo nếu có VĐV chưa được ghép
     if unpaired:
@@ -2691,82 +4712,128 @@ def make_pairs_for_tournament(t_id):
             f"Còn {len(unpaired)} VĐV chưa được ghép cặp: {names}"
         )
 
+    if not made:
+        return None
+    return {
+        "spread": statistics.pstdev(strength[a] + strength[b] for a, b in made),
+        "repeats": sum(1 for a, b in made if frozenset((a, b)) in history),
+    }
+
+def balance_teams(players, num_teams, strength):
+    """
+    Chia đội cân bằng bằng tìm kiếm cục bộ.
+    - players: [{"user_id", "group", "female"}]; strength: {user_id: hạng} (nhỏ = mạnh)
+    - Mỗi nhóm trình được chia vòng bắt đầu từ đội đang ít người nhất -> sĩ số và số người
+      mỗi nhóm giữa các đội lệch nhau tối đa 1, với mọi cỡ nhóm.
+    - Sau đó đổi chỗ 2 VĐV cùng nhóm ở 2 đội khác nhau khi việc đổi làm giảm
+      (độ lệch số VĐV Nữ, độ lệch hạng trung bình) – ưu tiên cân bằng Nữ trước.
+    Trả về [[user_id, ...] cho từng đội].
+    """
+    group_of = {p["user_id"]: p["group"] for p in players}
+    female = {p["user_id"]: 1 if p["female"] else 0 for p in players}
+    teams = [[] for _ in range(num_teams)]
+    by_group = {}
+    for p in players:
+        by_group.setdefault(p["group"], []).append(p["user_id"])
+    for g in sorted(by_group, key=lambda g: (g == "", g)):
+        members = by_group[g][:]
+        random.shuffle(members)
+        order = sorted(range(num_teams), key=lambda t: (len(teams[t]), random.random()))
+        for i, uid in enumerate(members):
+            teams[order[i % num_teams]].append(uid)
+
+    size = [len(t) for t in teams]
+    total = [sum(strength[u] for u in t) for t in teams]
+    women = [sum(female[u] for u in t) for t in teams]
+    mean_strength = sum(total) / max(1, sum(size))
+    mean_women = sum(women) / num_teams
+
+    def cost(t, tot, w):
+        return (w - mean_women) ** 2, (tot / size[t] - mean_strength) ** 2 if size[t] else 0.0
+
+    improved = True
+    while improved:
+        improved = False
+        for a in range(num_teams):
+            for b in range(a + 1, num_teams):
+                for i in range(size[a]):
+                    for j in range(size[b]):
+                        x = teams[a][i]; y = teams[b][j]
+                        if group_of[x] != group_of[y]:
+                            continue
+                        ds = strength[y] - strength[x]; dw = female[y] - female[x]
+                        old_w, old_s = (u + v for u, v in zip(cost(a, total[a], women[a]), cost(b, total[b], women[b])))
+                        new_w, new_s = (u + v for u, v in zip(cost(a, total[a] + ds, women[a] + dw), cost(b, total[b] - ds, women[b] - dw)))
+                        if (new_w, new_s) < (old_w, old_s - 1e-9):
+                            teams[a][i], teams[b][j] = y, x
+                            total[a] += ds; total[b] -= ds
+                            women[a] += dw; women[b] -= dw
+                            improved = True
+    return teams
+
+def team_balance_metrics(teams, players, strength):
+    """Chỉ số cân bằng từng đội: sĩ số, số Nữ, hạng trung bình, số người mỗi nhóm trình."""
+    info = {p["user_id"]: p for p in players}
+    groups = sorted({p["group"] for p in players}, key=lambda g: (g == "", g))
+    rows = []
+    for i, t in enumerate(teams, start=1):
+        row = {
+            "Đội": f"Đội {i}",
+            "Số VĐV": len(t),
+            "Nữ": sum(1 for u in t if info[u]["female"]),
+            "Hạng TB": round(statistics.fmean(strength[u] for u in t), 1) if t else None,
+        }
+        for g in groups:
+            row[f"Nhóm {g or '-'}"] = sum(1 for u in t if info[u]["group"] == g)
+        rows.append(row)
+    return rows
+
 def make_teams_for_tournament(t_id, num_teams):
     """
     Chia đội dựa trên phân nhóm trình:
-    - Các nhóm (A, B, C, D, ...) được coi là các tầng trình độ, A mạnh nhất.
-    - Với mỗi nhóm: xáo ngẫu nhiên, rồi phân vòng tròn vào các đội.
-    => Mỗi đội có cùng số thành viên từ mỗi nhóm (nếu số lượng nhóm chia hết cho số đội).
+    - Các nhóm (A, B, C, D, ...) được coi là các tầng trình độ, A mạnh nhất; nhóm rỗng xếp cuối.
+    - Nhóm không cần chia hết cho số đội: balance_teams cân bằng sĩ số, số người mỗi nhóm,
+      số VĐV Nữ và tổng sức mạnh HNPR của các đội.
+    Trả về bảng chỉ số cân bằng (team_balance_metrics) hoặc None nếu không chia được.
     """
     players = get_tournament_players(t_id)
 
     # 1. Kiểm tra đủ VĐV tối thiểu
     if len(players) < num_teams:
         st.warning("Số đội lớn hơn số VĐV, không thể chia.")
-        return
-
-    # 2. Gom theo group_name
-    group_map = {}
-    for p in players:
-        gname = p["group_name"] or ""   # nhóm rỗng cho vào ""
-        group_map.setdefault(gname, []).append(p)
-
-    if not group_map:
-        st.warning("Chưa có phân nhóm trình, hãy phân nhóm trình trước khi chia đội.")
-        return
-
-    # 3. Sắp xếp thứ tự nhóm:
-    #    - Nhóm có tên (A, B, C, ...) trước, theo alphabet
-    #    - Nhóm rỗng "" (không phân nhóm trình) xếp cuối, coi như yếu nhất
-    group_keys = sorted(group_map.keys(), key=lambda g: (g == "" or g is None, g))
-
-    # 4. Kiểm tra từng nhóm có chia đều cho số đội không
-    for g in group_keys:
-        cnt = len(group_map[g])
-        if cnt % num_teams != 0:
-            label = g if g else "Không nhóm"
-            st.error(
-                f"Nhóm {label} có {cnt} VĐV, không chia đều được cho {num_teams} đội.\n"
-                f"Vui lòng điều chỉnh lại phân nhóm trình hoặc giảm/tăng số đội."
-            )
-            return
+        return None
 
-    # 5. Khởi tạo danh sách thành viên cho từng đội
-    team_members = {i: [] for i in range(num_teams)}
+    pool = [
+        {"user_id": p["user_id"], "group": p["group_name"] or "", "female": (p["gender"] or "") == "Nữ"}
+        for p in players
+    ]
+    strength = get_player_strengths([p["user_id"] for p in pool], "hnpr")
 
-    # 6. Với từng group: random rồi phân vòng tròn vào đội
     random.seed()
-    for g in group_keys:
-        group_players = group_map[g][:]   # copy list
-        random.shuffle(group_players)
+    teams = balance_teams(pool, num_teams, strength)
 
-        # Phân lần lượt: người i -> đội (i % num_teams)
-        for idx, p in enumerate(group_players):
-            team_idx = idx % num_teams
-            team_members[team_idx].append(p["user_id"])
-
-    # 7. Xoá đội & lịch sử cũ, tạo lại competitors và competitor_members
+    # Xoá đội & lịch sử cũ, tạo lại competitors và competitor_members
     clear_competitors_and_matches(t_id)
     conn = get_conn()
     cur = conn.cursor()
 
-    for i in range(num_teams):
+    for i, uids in enumerate(teams):
         team_name = f"Đội {i+1}"
         cur.execute(
             "INSERT INTO competitors (tournament_id, name, kind) VALUES (?, ?, 'team')",
             (t_id, team_name),
         )
         cid = cur.lastrowid
-
-        for uid in team_members[i]:
-            cur.execute(
-                "INSERT INTO competitor_members (competitor_id, user_id) VALUES (?, ?)",
-                (cid, uid),
-            )
+        cur.executemany(
+            "INSERT INTO competitor_members (competitor_id, user_id) VALUES (?, ?)",
+            [(cid, uid) for uid in uids],
+        )
 
     conn.commit()
     conn.close()
+    invalidate(tournament_scope(t_id))
     st.success("Đã chia đội tự động dựa trên phân nhóm trình.")
+    return team_balance_metrics(teams, pool, strength)
 
 def ui_tournament_pairs_teams_view(t_id):
     t = get_tournament_by_id(t_id)
@@ -2797,10 +4864,11 @@ def ui_tournament_pairs_teams_view(t_id):
     # THI ĐẤU THEO CẶP -> giữ nguyên layout lưới cũ
     else:
         st.markdown("### 🎾 Danh sách cặp đấu")
+        names = get_competitor_display_names(t_id, comps, m_map)
         cols = st.columns(3)
         for i, c in enumerate(comps):
             with cols[i % 3]:
-                st.success(f"{build_competitor_display_name(c['id'], m_map)}")
+                st.success(f"{names[c['id']]}")
 
 def ui_manual_team_assignment(t_id, num_teams):
     players = get_tournament_players(t_id)
@@ -2880,6 +4948,7 @@ def ui_manual_team_assignment(t_id, num_teams):
 
     conn.commit()
     conn.close()
+    invalidate(tournament_scope(t_id))
     st.success("Đã chia đội bằng tay.")
     st.rerun()
 
@@ -2889,10 +4958,33 @@ def ui_tournament_pairs_teams(t_id):
     st.markdown("#### Tạo Đội thi đấu")
 
     if ctype != "team":
+        pair_mode = st.radio(
+            "Cách ghép",
+            ["Bốc ngẫu nhiên theo nhóm", "Cân bằng sức mạnh"],
+            horizontal=True,
+            key=f"pair_mode_{t_id}",
+        )
+        source = "hnpr"; randomness = 0.0
+        if pair_mode == "Cân bằng sức mạnh":
+            c_src, c_rand = st.columns(2)
+            source = "btc" if c_src.radio("Theo", ["HNPR", "BXH BTC"], horizontal=True, key=f"pair_src_{t_id}") == "BXH BTC" else "hnpr"
+            randomness = c_rand.slider("Độ ngẫu nhiên", 0.0, 1.0, 0.3, 0.05, key=f"pair_rand_{t_id}")
+        history_weight = st.slider(
+            "Tránh lặp đồng đội cũ", 0.0, 3.0, 1.0, 0.5, key=f"pair_hist_{t_id}",
+            help="0 = bỏ qua lịch sử; càng cao càng tránh ghép lại cặp đã đánh cùng nhau (nhất là ở giải gần đây).",
+        )
         if st.button("⚡ Ghép cặp tự động", type="primary"):
-            make_pairs_for_tournament(t_id)
+            res = make_pairs_for_tournament(
+                t_id, "balanced" if pair_mode == "Cân bằng sức mạnh" else "random", source, randomness, history_weight
+            )
+            if res is not None:
+                st.session_state[f"pair_msg_{t_id}"] = (
+                    f"Độ lệch chuẩn tổng hạng các cặp: {res['spread']:.1f} · Cặp lặp lại từ giải trước: {res['repeats']}"
+                )
             st.success("Xong.")
             st.rerun()
+        if f"pair_msg_{t_id}" in st.session_state:
+            st.caption(st.session_state[f"pair_msg_{t_id}"])
         return
 
     # ===== TEAM MODE =====
@@ -2908,18 +5000,23 @@ def ui_tournament_pairs_teams(t_id):
 
     if mode == "Chia đội tự động":
         if c2.button("⚡ Chia đội tự động", type="primary"):
-            make_teams_for_tournament(t_id, int(num_teams))
+            metrics = make_teams_for_tournament(t_id, int(num_teams))
+            if metrics is not None:
+                st.session_state[f"team_metrics_{t_id}"] = metrics
             st.success("Xong.")
             st.rerun()
+        if f"team_metrics_{t_id}" in st.session_state:
+            st.caption("Chỉ số cân bằng lần chia gần nhất (Hạng TB theo HNPR, nhỏ = mạnh):")
+            st.dataframe(st.session_state[f"team_metrics_{t_id}"], use_container_width=True, hide_index=True)
     else:
         ui_manual_team_assignment(t_id, int(num_teams))
 
     ui_tournament_pairs_teams_view(t_id)
 
 def ui_tournament_pools_view(t_id):
-    comps = get_competitors(t_id); m_map = get_competitor_members_map(t_id)
+    comps = get_competitors(t_id); names = get_competitor_display_names(t_id, comps)
     p_map = {}
-    for c in comps: p_map.setdefault(c["pool_name"] or "N/A", []).append(build_competitor_display_name(c["id"], m_map))
+    for c in comps: p_map.setdefault(c["pool_name"] or "N/A", []).append(names[c["id"]])
     if not p_map: return
     st.write("### 🎱 Danh sách Bảng")
     cols = st.columns(len(p_map) if len(p_map) <= 4 else 4)
@@ -2941,41 +5038,59 @@ def ui_tournament_pools(t_id):
         conn = get_conn(); cur = conn.cursor()
         for i, c in enumerate(comps): cur.execute("UPDATE competitors SET pool_name = ? WHERE id = ?", (pns[i%len(pns)], c["id"]))
         cur.execute("UPDATE tournaments SET adv_per_pool = ? WHERE id = ?", (int(ap), t_id))
-        conn.commit(); conn.close(); st.success("Xong."); st.rerun()
+        _rebuild_standings(cur, t_id)  # BXH bảng phụ thuộc việc chia bảng
+        conn.commit(); conn.close(); invalidate(tournament_scope(t_id)); st.success("Xong."); st.rerun()
     ui_tournament_pools_view(t_id)
 
+def format_match_label(m):
+    score_txt = f"{m['score1']} - {m['score2']}" if m["score1"] is not None else "vs"
+    return f"#{m['id']}: {m['name1']} {score_txt} {m['name2']}"
+
 def ui_tournament_results_view(t_id):
     st.markdown("### 📅 Lịch & Kết quả")
     t = get_tournament_by_id(t_id); ctype = t["competition_type"] if "competition_type" in t.keys() else "pair"
-    matches = get_matches(t_id); m_map = get_competitor_members_map(t_id)
+    matches = get_matches(t_id)
     if not matches: st.info("Chưa có trận đấu."); return
+    names = get_competitor_display_names(t_id) if ctype != "team" else {}
+    ko_rounds = len(get_bracket(t_id))
     
     for m in matches:
         m_type = m["match_type"] if "match_type" in m.keys() and m["match_type"] else "standard"
         
         if ctype == "team":
-            def gn(p1, p2): return ", ".join([get_user_by_id(uid)["full_name"] for uid in [p1, p2] if uid])
+            def gn(n1, n2): return ", ".join([n for n in [n1, n2] if n])
             
             if m_type == "relay":
                 # Trận tiếp sức
                 sub_info1 = "<span style='color:#d97706; font-size:0.8rem;'>★ TIẾP SỨC</span>"
                 sub_info2 = "<span style='color:#d97706; font-size:0.8rem;'>★ TIẾP SỨC</span>"
-            else:
+            elif m["team1_p1_id"] or m["team2_p1_id"]:
                 # Trận thường
-                sub_info1 = f"<small>({gn(m['team1_p1_id'], m['team1_p2_id'])})</small>"
-                sub_info2 = f"<small>({gn(m['team2_p1_id'], m['team2_p2_id'])})</small>"
+                sub_info1 = f"<small>({gn(m['team1_p1_name'], m['team1_p2_name'])})</small>"
+                sub_info2 = f"<small>({gn(m['team2_p1_name'], m['team2_p2_name'])})</small>"
+            else:
+                # Trận trong lịch, chưa có đội hình
+                sub_info1 = sub_info2 = ""
                 
             n1 = f"{m['name1']} <br>{sub_info1}"
             n2 = f"{m['name2']} <br>{sub_info2}"
         else:
-            n1 = build_competitor_display_name(m["competitor1_id"], m_map)
-            n2 = build_competitor_display_name(m["competitor2_id"], m_map)
+            n1 = names.get(m["competitor1_id"], m["name1"])
+            n2 = names.get(m["competitor2_id"], m["name2"])
+
+        score_txt = f"{m['score1']} - {m['score2']}" if m["score1"] is not None else "vs"
+        sched = []
+        if m["stage"] == "knockout": sched.append(bracket_round_name(m["round_no"], ko_rounds))
+        elif m["round_no"]: sched.append(f"Lượt {m['round_no']}")
+        if m["slot_no"]: sched.append(f"Khung giờ {m['slot_no']} · Sân {m['court_no']}")
+        round_txt = f"<div style='text-align:center; color:#6B7280; font-size:0.75rem; margin-bottom:6px;'>{' · '.join(sched)}</div>" if sched else ""
             
         st.markdown(f"""
         <div style="background:white; padding:15px; border-radius:8px; border:1px solid #eee; margin-bottom:10px; box-shadow:0 1px 2px rgba(0,0,0,0.03);">
+            {round_txt}
             <div style="display:flex; justify-content:space-between; align-items:center;">
                 <div style="text-align:right; width:40%; font-weight:600; color:#333;">{n1}</div>
-                <div style="background:#F3F4F6; color:#333; padding:5px 15px; border-radius:20px; font-weight:bold; border:1px solid #e5e7eb;">{m['score1']} - {m['score2']}</div>
+                <div style="background:#F3F4F6; color:#333; padding:5px 15px; border-radius:20px; font-weight:bold; border:1px solid #e5e7eb;">{score_txt}</div>
                 <div style="text-align:left; width:40%; font-weight:600; color:#333;">{n2}</div>
             </div>
         </div>""", unsafe_allow_html=True)
@@ -2989,8 +5104,9 @@ def ui_tournament_results(t_id):
 
     with st.expander("📝 Nhập kết quả", expanded=True):
         labels = []; c_map = {}
+        names = get_competitor_display_names(t_id, comps, m_map)
         for c in comps:
-            lbl = c["name"] if c["kind"]=="team" else build_competitor_display_name(c["id"], m_map)
+            lbl = c["name"] if c["kind"]=="team" else names[c["id"]]
             labels.append(lbl); c_map[lbl] = c["id"]
         
         # --- BỔ SUNG: Chọn loại trận ---
@@ -3021,6 +5137,12 @@ def ui_tournament_results(t_id):
             else:
                 st.info("ℹ️ Trận tiếp sức: Không cần chọn từng thành viên.")
 
+        # Đã có nhánh đấu -> hỏi kết quả thuộc vòng nào (2 đội có thể có cả trận bảng lẫn trận loại trực tiếp)
+        stage_val = None
+        if get_bracket(t_id):
+            stage_display = st.radio("Vòng đấu", ["Loại trực tiếp", "Vòng bảng"], horizontal=True, key=f"stage_{t_id}")
+            stage_val = "knockout" if stage_display == "Loại trực tiếp" else "group"
+
         sc1, sc2 = st.columns(2)
         scr1 = sc1.number_input("Điểm 1", 0, 100, 0)
         scr2 = sc2.number_input("Điểm 2", 0, 100, 0)
@@ -3037,11 +5159,126 @@ def ui_tournament_results(t_id):
                 tp = (t1i[0], t1i[1], t2i[0], t2i[1])
                 
             # Gọi hàm add_match với tham số match_type
-            add_match(t_id, cid1, cid2, int(scr1), int(scr2), st.session_state["user"]["id"], True, tp, match_type=match_type_val)
-            st.success("Lưu thành công."); st.rerun()
-            
+            if add_match(t_id, cid1, cid2, int(scr1), int(scr2), st.session_state["user"]["id"], True, tp, match_type=match_type_val, stage=stage_val) is not None:
+                st.success("Lưu thành công."); st.rerun()
+
+    with st.expander("📋 Nhập nhiều kết quả", expanded=False):
+        ui_bulk_results(t_id, ctype, labels, c_map, m_map)
+
+    is_swiss = t["pairing_system"] == "swiss"
+    with st.expander("📅 Lịch thi đấu Swiss" if is_swiss else "📅 Lịch thi đấu vòng tròn", expanded=False):
+        if is_swiss:
+            st.caption(
+                "Mỗi lượt ghép các cặp/đội cùng điểm theo BXH hiện tại, không gặp lại đối cũ; "
+                "đội lẻ được nghỉ lượt (tính 1 trận thắng). Nhập đủ kết quả lượt trước rồi mới xếp lượt mới."
+            )
+        else:
+            st.caption(
+                "Tạo lịch vòng tròn cho từng bảng (hoặc cả giải nếu không phân bảng). "
+                "Lịch chưa đấu cũ sẽ được thay thế; khi nhập kết quả, tỉ số được điền vào đúng trận trong lịch."
+            )
+        c_gen, c_clr = st.columns(2)
+        if is_swiss:
+            if c_gen.button("⚡ Xếp lượt Swiss tiếp theo", key=f"gen_swiss_{t_id}"):
+                res = generate_swiss_round(t_id)
+                if res is None:
+                    st.error("Lượt trước còn trận chưa có kết quả.")
+                else:
+                    round_no, n_fix, bye = res
+                    bye_txt = f" Nghỉ lượt: {names[bye]}." if bye is not None else ""
+                    st.success(f"Đã xếp lượt {round_no}: {n_fix} trận.{bye_txt}"); st.rerun()
+        elif c_gen.button("⚡ Tạo lịch vòng tròn", key=f"gen_rr_{t_id}"):
+            n_fix = generate_round_robin(t_id)
+            st.success(f"Đã tạo {n_fix} trận trong lịch."); st.rerun()
+        if c_clr.button("🗑 Xoá lịch chưa đấu", key=f"clear_rr_{t_id}"):
+            clear_unplayed_fixtures(t_id)
+            st.success("Đã xoá các trận chưa đấu."); st.rerun()
+
+        st.markdown("##### Xếp sân & khung giờ")
+        st.caption(f"Dùng {t['num_courts'] or 4} sân (theo cấu hình giải). Một VĐV không bao giờ thi đấu 2 sân cùng lúc.")
+        c_rest, c_len, c_btn = st.columns(3)
+        min_rest = c_rest.number_input("Nghỉ tối thiểu (khung giờ)", 0, 5, 0, key=f"min_rest_{t_id}")
+        slot_min = c_len.number_input("Độ dài khung giờ (phút)", 5, 120, 20, key=f"slot_min_{t_id}")
+        if c_btn.button("🗓 Xếp sân", key=f"assign_courts_{t_id}"):
+            n_sched, makespan = assign_courts(t_id, int(min_rest))
+            total_min = makespan * int(slot_min)
+            st.session_state[f"court_msg_{t_id}"] = (
+                f"Đã xếp {n_sched} trận vào {makespan} khung giờ "
+                f"(≈ {total_min // 60} giờ {total_min % 60} phút)."
+            )
+            st.rerun()
+        if f"court_msg_{t_id}" in st.session_state:
+            st.success(st.session_state[f"court_msg_{t_id}"])
+
+    matches = get_matches(t_id)
+    if matches:
+        with st.expander("🗑 Xoá trận / kết quả đã nhập", expanded=False):
+            m_opts = {format_match_label(m): m["id"] for m in matches}
+            sel_m = st.selectbox("Chọn trận", list(m_opts.keys()), key=f"del_match_{t_id}")
+            if st.button("🗑 Xoá trận", key=f"del_match_btn_{t_id}"):
+                if delete_match(m_opts[sel_m]):
+                    st.success("Đã xoá trận."); st.rerun()
+                else:
+                    st.error("Trận vòng sau đã có kết quả, hãy xoá kết quả đó trước.")
+
     ui_tournament_results_view(t_id)
 
+def ui_bulk_results(t_id, ctype, labels, c_map, m_map):
+    st.caption(
+        "Điền tỉ số vào các trận trong lịch (thêm dòng cho trận mới) và/hoặc dán từ CSV / bảng tính. "
+        "Dòng chưa có tỉ số được bỏ qua; mọi dòng được kiểm tra trước, có lỗi thì không ghi dòng nào."
+    )
+    is_team = ctype == "team"
+    ver = st.session_state.get(f"bulk_ver_{t_id}", 0)
+    names = {cid: lbl for lbl, cid in c_map.items()}
+    grid = [
+        {"Đội 1": names.get(m["competitor1_id"]), "Đội 2": names.get(m["competitor2_id"]), "Điểm 1": None, "Điểm 2": None,
+         **({"Loại trận": "Thường", "VĐV đội 1": "", "VĐV đội 2": ""} if is_team else {})}
+        for m in get_matches(t_id) if m["score1"] is None
+    ]
+    col_cfg = {
+        "Đội 1": st.column_config.SelectboxColumn(options=labels),
+        "Đội 2": st.column_config.SelectboxColumn(options=labels),
+        "Điểm 1": st.column_config.NumberColumn(min_value=0, max_value=100, step=1),
+        "Điểm 2": st.column_config.NumberColumn(min_value=0, max_value=100, step=1),
+    }
+    if is_team:
+        col_cfg["Loại trận"] = st.column_config.SelectboxColumn(options=["Thường", "Tiếp sức"])
+        col_cfg["VĐV đội 1"] = st.column_config.TextColumn(help="2 tên, cách nhau bởi dấu +")
+        col_cfg["VĐV đội 2"] = st.column_config.TextColumn(help="2 tên, cách nhau bởi dấu +")
+    edited = st.data_editor(
+        grid or [{k: None for k in col_cfg}],
+        column_config=col_cfg,
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        key=f"bulk_grid_{t_id}_{ver}",
+    )
+    if hasattr(edited, "to_dict"):
+        edited = edited.to_dict("records")
+    pasted = st.text_area(
+        "Dán CSV / bảng tính",
+        placeholder="Đội 1, Đội 2, Điểm 1, Điểm 2" + (", Loại trận, VĐV đội 1, VĐV đội 2" if is_team else ""),
+        key=f"bulk_csv_{t_id}_{ver}",
+    )
+
+    if st.button("💾 Lưu tất cả", type="primary", key=f"bulk_save_{t_id}"):
+        rows = [
+            {"team1": r.get("Đội 1"), "team2": r.get("Đội 2"), "score1": r.get("Điểm 1"), "score2": r.get("Điểm 2"),
+             "match_type": r.get("Loại trận"), "lineup1": r.get("VĐV đội 1"), "lineup2": r.get("VĐV đội 2")}
+            for r in edited
+        ] + parse_results_text(pasted)
+        lookup = {lbl.lower(): cid for lbl, cid in c_map.items()}
+        results, errors = validate_bulk_results(rows, lookup, m_map, ctype)
+        if errors:
+            st.error("Chưa lưu – sửa các lỗi sau:\n\n" + "\n".join(f"- {e}" for e in errors))
+        elif not results:
+            st.warning("Chưa có tỉ số nào để lưu.")
+        else:
+            add_matches_bulk(t_id, results, st.session_state["user"]["id"])
+            st.session_state[f"bulk_ver_{t_id}"] = ver + 1
+            st.rerun()
+
 def ui_tournament_standings(t_id):
     t = get_tournament_by_id(t_id)
     use_pools = bool(t["use_pools"])
@@ -3072,6 +5309,10 @@ def ui_tournament_standings(t_id):
                     "Note": "✅ Đi tiếp" if s["id"] in q_ids else ""
                 })
             st.dataframe(rows, use_container_width=True, hide_index=True)
+
+        n_cross = count_cross_pool_matches(t_id)
+        if n_cross:
+            st.caption(f"ℹ️ {n_cross} trận giữa các bảng khác nhau không được tính vào BXH bảng.")
     else:
         std = compute_standings(t_id)
         if std:
@@ -3087,10 +5328,63 @@ def ui_tournament_standings(t_id):
         else: 
             st.info("Chưa có dữ liệu.")
 
+    ui_knockout_bracket_view(t_id)
+
+def ui_knockout_bracket_view(t_id):
+    rounds = get_bracket(t_id)
+    if not rounds: return
+    names = get_competitor_display_names(t_id)
+    st.markdown("### 🏅 Vòng loại trực tiếp")
+    card_h, gap = 64, 12
+    cols = st.columns(len(rounds))
+    for r, (col, nodes) in enumerate(zip(cols, rounds), start=1):
+        step = (card_h + gap) * 2 ** (r - 1)
+        html = [f"<div style='text-align:center; font-weight:600; color:#6B7280; margin-bottom:8px;'>{bracket_round_name(r, len(rounds))}</div>",
+                f"<div style='height:{(step - card_h - gap) // 2}px;'></div>"]
+        for nd in nodes:
+            lines = []
+            for side in (1, 2):
+                cid = nd[f"competitor{side}_id"]
+                if cid is None:
+                    label = "BYE" if r == 1 else "—"
+                else:
+                    label = f"<small style='color:#9CA3AF;'>#{nd[f'seed{side}']}</small> {names.get(cid, '?')}"
+                score = nd[f"score{side}"] if nd[f"score{side}"] is not None else ""
+                weight = "700" if cid is not None and cid == nd["winner_id"] else "400"
+                lines.append(
+                    f"<div style='display:flex; justify-content:space-between; font-weight:{weight};'>"
+                    f"<span style='overflow:hidden; white-space:nowrap; text-overflow:ellipsis;'>{label}</span><span>{score}</span></div>"
+                )
+            html.append(
+                f"<div style='height:{card_h}px; box-sizing:border-box; background:white; border:1px solid #e5e7eb; border-radius:8px; "
+                f"padding:6px 10px; font-size:0.85rem; margin-bottom:{step - card_h}px;'>{''.join(lines)}</div>"
+            )
+        col.markdown("".join(html), unsafe_allow_html=True)
+
+def ui_tournament_knockout(t_id):
+    with st.expander("🏅 Tạo nhánh đấu loại trực tiếp", expanded=False):
+        t = get_tournament_by_id(t_id)
+        st.caption(
+            f"Lấy {t['adv_per_pool'] or 1} đội đầu mỗi bảng; nhất các bảng tránh nhau ở vòng đầu, "
+            "đội hạt giống cao được bye nếu số đội không phải luỹ thừa của 2. "
+            "Nhập kết quả trận loại trực tiếp ở mục Nhập kết quả, đội thắng tự động đi tiếp."
+            if t["use_pools"] else
+            "Lấy các đội đầu BXH chung (theo số đội đi tiếp của giải, mặc định tất cả)."
+        )
+        c_gen, c_clr = st.columns(2)
+        if c_gen.button("⚡ Tạo nhánh đấu", key=f"gen_ko_{t_id}"):
+            n = generate_knockout(t_id)
+            if n is None: st.error("Đã có kết quả vòng loại trực tiếp, hãy xoá nhánh đấu trước.")
+            elif n < 2: st.warning("Chưa đủ đội đi tiếp.")
+            else: st.success(f"Đã tạo nhánh đấu {n} đội."); st.rerun()
+        if c_clr.button("🗑 Xoá nhánh đấu", key=f"clear_ko_{t_id}"):
+            clear_knockout(t_id)
+            st.success("Đã xoá nhánh đấu."); st.rerun()
+
 # ------------------ Main app ------------------ #
 
 def main():
-    init_db()
+    init_db(DB_PATH)
 
     user = st.session_state["user"]
 